@@ -0,0 +1,294 @@
+"""Watch-folder ingest daemon.
+
+Watches directories for new or changed STEP files (plain, .stp.gz, .stpz or
+zip), waits until each file has stopped changing, and extracts it on a
+bounded worker pool. Results are appended to the tolerance store and can also
+be written as CSV files to an output folder. Files whose content hash is
+already stored are skipped.
+
+Usage: python ingest.py DIR [DIR ...] [--output OUT] [--workers N]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from main import STORE_PATH, extract_from_upload, store_has_part, store_results
+
+WATCHED_EXTENSIONS = ('.step', '.stp', '.stp.gz', '.step.gz', '.stpz', '.zip')
+
+logger = logging.getLogger("gdnt.ingest")
+
+
+def is_step_path(path):
+    return path.lower().endswith(WATCHED_EXTENSIONS)
+
+
+class IngestMetrics:
+    """Thread-safe counters for the periodic throughput/queue-depth report"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {'processed': 0, 'skipped': 0, 'truncated': 0, 'failed': 0}
+        self.bytes = 0
+        self._last_report = (time.monotonic(), 0, 0)
+
+    def record(self, outcome, nbytes=0):
+        with self._lock:
+            self.counts[outcome] += 1
+            self.bytes += nbytes
+
+    def report(self, queue_depth, pending):
+        with self._lock:
+            now = time.monotonic()
+            last_time, last_files, last_bytes = self._last_report
+            files = self.counts['processed'] + self.counts['truncated']
+            elapsed = max(now - last_time, 1e-9)
+            self._last_report = (now, files, self.bytes)
+            return {
+                **self.counts,
+                'queue_depth': queue_depth,
+                'pending_debounce': pending,
+                'files_per_s': (files - last_files) / elapsed,
+                'mb_per_s': (self.bytes - last_bytes) / elapsed / 1024 / 1024,
+            }
+
+
+class Debouncer:
+    """Hold paths until they have seen no events and a stable size for ``delay`` seconds.
+
+    Partially written files keep generating modify events or growing, so they
+    are only released once the writer has finished.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._pending = {}  # path -> (last event time, last seen size)
+        self._lock = threading.Lock()
+
+    def touch(self, path):
+        with self._lock:
+            self._pending[path] = (time.monotonic(), None)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def ready(self):
+        """Return the paths that have settled, removing them from the pending set"""
+        now = time.monotonic()
+        settled = []
+        with self._lock:
+            for path, (last_event, last_size) in list(self._pending.items()):
+                if now - last_event < self.delay:
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    del self._pending[path]  # deleted or moved away
+                    continue
+                if size == last_size:
+                    del self._pending[path]
+                    settled.append(path)
+                else:
+                    self._pending[path] = (now, size)
+        return settled
+
+
+class StepEventHandler(FileSystemEventHandler):
+    def __init__(self, debouncer):
+        self.debouncer = debouncer
+
+    def on_created(self, event):
+        if not event.is_directory and is_step_path(event.src_path):
+            self.debouncer.touch(event.src_path)
+
+    on_modified = on_created
+
+    def on_moved(self, event):
+        if not event.is_directory and is_step_path(event.dest_path):
+            self.debouncer.touch(event.dest_path)
+
+
+class IngestDaemon:
+    """Watch directories and extract settled STEP files on a bounded worker pool"""
+
+    def __init__(self, directories, output_dir=None, store_path=STORE_PATH,
+                 workers=None, queue_size=100, debounce=2.0, metrics_interval=30.0,
+                 initial_scan=True):
+        self.directories = directories
+        self.output_dir = output_dir
+        self.store_path = store_path
+        self.workers = workers or os.cpu_count() or 1
+        self.metrics_interval = metrics_interval
+        self.initial_scan = initial_scan
+
+        self.debouncer = Debouncer(debounce)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.metrics = IngestMetrics()
+        self.stop_event = threading.Event()
+        # Last content hash stored per path, to skip unchanged files without the
+        # store, and the (path, hash) pairs a worker is extracting right now
+        self._seen_hashes = {}
+        self._in_progress = set()
+        self._seen_lock = threading.Lock()
+
+    def process(self, path):
+        """Extract one file, skipping it if its content is already stored.
+
+        Extraction and store errors propagate to the worker, which counts the
+        file as failed; its hash is only remembered once it is stored, so a
+        failed file is retried on its next event.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+        claim = (path, content_hash)
+        with self._seen_lock:
+            unchanged = self._seen_hashes.get(path) == content_hash or claim in self._in_progress
+            if not unchanged:
+                self._in_progress.add(claim)
+        if unchanged:
+            self.metrics.record('skipped')
+            logger.debug("Skipping unchanged %s", path)
+            return
+
+        try:
+            if store_has_part(content_hash, self.store_path):
+                self._remember(path, content_hash)
+                self.metrics.record('skipped')
+                logger.debug("Skipping stored %s", path)
+                return
+
+            upload = SimpleNamespace(type="application/octet-stream", getvalue=lambda: data)
+            rows, stats, truncated = extract_from_upload(upload, self.stop_event)
+            name = os.path.basename(path)
+            if truncated:
+                # Partial results stay out of the store so a later run can retry
+                logger.warning("Truncated %s: %s", path, "; ".join(truncated))
+            else:
+                store_results(name, content_hash, rows, self.store_path, stats)
+                self._remember(path, content_hash)
+            if self.output_dir:
+                stem = name.split(".", 1)[0]
+                pd.DataFrame(rows).to_csv(
+                    os.path.join(self.output_dir, f"{stem}_{content_hash[:8]}.csv"), index=False)
+        finally:
+            with self._seen_lock:
+                self._in_progress.discard(claim)
+
+        self.metrics.record('truncated' if truncated else 'processed', len(data))
+        logger.info("Extracted %d entries from %s", len(rows), path)
+
+    def _remember(self, path, content_hash):
+        with self._seen_lock:
+            self._seen_hashes[path] = content_hash
+
+    def _worker(self):
+        while True:
+            path = self.queue.get()
+            try:
+                if path is None:
+                    return
+                self.process(path)
+            except Exception:
+                self.metrics.record('failed')
+                logger.exception("Failed to ingest %s", path)
+            finally:
+                self.queue.task_done()
+
+    def _enqueue(self, path):
+        # Blocks while the queue is full, so a burst of files applies
+        # backpressure instead of growing memory without bound
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(path, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def run(self):
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+
+        workers = [threading.Thread(target=self._worker, name=f"ingest-{i}", daemon=True)
+                   for i in range(self.workers)]
+        for worker in workers:
+            worker.start()
+
+        observer = Observer()
+        handler = StepEventHandler(self.debouncer)
+        for directory in self.directories:
+            observer.schedule(handler, directory, recursive=True)
+        observer.start()
+        logger.info("Watching %s with %d workers", ", ".join(self.directories), self.workers)
+
+        if self.initial_scan:
+            for directory in self.directories:
+                for root, _, files in os.walk(directory):
+                    for filename in files:
+                        if is_step_path(filename):
+                            self.debouncer.touch(os.path.join(root, filename))
+
+        next_report = time.monotonic() + self.metrics_interval
+        try:
+            while not self.stop_event.is_set():
+                for path in self.debouncer.ready():
+                    self._enqueue(path)
+                if time.monotonic() >= next_report:
+                    logger.info("Metrics %s", self.metrics.report(
+                        self.queue.qsize(), len(self.debouncer)))
+                    next_report = time.monotonic() + self.metrics_interval
+                self.stop_event.wait(0.5)
+        finally:
+            # Cancels in-flight extractions through their parse budgets
+            self.stop_event.set()
+            observer.stop()
+            observer.join()
+            for _ in workers:
+                self.queue.put(None)
+            for worker in workers:
+                worker.join()
+            logger.info("Final metrics %s", self.metrics.report(self.queue.qsize(), len(self.debouncer)))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directories", nargs="+", help="directories to watch (recursively)")
+    parser.add_argument("--output", help="also write one CSV of results per file here")
+    parser.add_argument("--store", default=STORE_PATH, help="tolerance store to append to")
+    parser.add_argument("--workers", type=int, default=None, help="extraction threads")
+    parser.add_argument("--queue-size", type=int, default=100,
+                        help="maximum settled files waiting for a worker")
+    parser.add_argument("--debounce", type=float, default=2.0,
+                        help="seconds a file must stay unchanged before it is extracted")
+    parser.add_argument("--metrics-interval", type=float, default=30.0)
+    parser.add_argument("--no-initial-scan", action="store_true",
+                        help="only ingest files that change after startup")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    daemon = IngestDaemon(
+        args.directories, output_dir=args.output, store_path=args.store,
+        workers=args.workers, queue_size=args.queue_size, debounce=args.debounce,
+        metrics_interval=args.metrics_interval, initial_scan=not args.no_initial_scan)
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,30 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import re
 import os
+import io
+import gzip
+import zipfile
+import threading
+import time
+import sqlite3
+import hashlib
+import uuid
+from contextlib import closing, contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import StringIO, BytesIO
-import base64
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime
+import xlsxwriter
+from datetime import datetime, timedelta
 import json
-
-# Set page config
-st.set_page_config(
-    page_title="GD&T Tolerance Extractor",
-    page_icon="📐",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Enhanced CSS for modern styling
-st.markdown("""
+PAGE_CSS = """
 <style>
     /* Import Google Fonts */
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
@@ -193,341 +199,1715 @@ st.markdown("""
         background: linear-gradient(135deg, #5a67d8 0%, #6b46c1 100%);
     }
 </style>
-""", unsafe_allow_html=True)
-
-# Initialize session state with more features
-if 'results_data' not in st.session_state:
-    st.session_state.results_data = []
-if 'filename' not in st.session_state:
-    st.session_state.filename = ""
-if 'processing_history' not in st.session_state:
-    st.session_state.processing_history = []
-if 'filter_settings' not in st.session_state:
-    st.session_state.filter_settings = {
-        'type_filter': 'All',
-        'datum_filter': 'All',
-        'location_filter': 'All'
+"""
+
+
+def setup_page():
+    """Configure the page and initialise session state for a Streamlit run"""
+    # Set page config
+    st.set_page_config(
+        page_title="GD&T Tolerance Extractor",
+        page_icon="📐",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
+
+    # Initialize session state with more features
+    # Parsed results live in the shared result cache, sessions only keep its key
+    if 'result_key' not in st.session_state:
+        st.session_state.result_key = None
+    if 'filename' not in st.session_state:
+        st.session_state.filename = ""
+    if 'processing_history' not in st.session_state:
+        st.session_state.processing_history = []
+    if 'filter_settings' not in st.session_state:
+        st.session_state.filter_settings = {
+            'type_filter': 'All',
+            'datum_filter': 'All',
+            'location_filter': 'All'
+        }
+    if 'analysis_results' not in st.session_state:
+        st.session_state.analysis_results = {}
+    # Last store query as (total, df, seconds), kept until the form is submitted again
+    if 'store_query' not in st.session_state:
+        st.session_state.store_query = None
+
+
+STEP_ENCODING = "utf-8"
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"PK\x03\x04"
+STEP_MEMBER_EXTENSIONS = ('.step', '.stp', '.txt')
+
+
+@contextmanager
+def open_step_binary(fileobj, member=None):
+    """Open the decompressed byte stream of a plain, gzip (.stp.gz/.stpz) or zipped STEP file.
+
+    For zip archives ``member`` selects the entry, defaulting to the first STEP member.
+    """
+    magic = fileobj.read(4)
+    fileobj.seek(0)
+
+    if magic[:2] == GZIP_MAGIC:
+        with gzip.GzipFile(fileobj=fileobj, mode='rb') as raw:
+            yield raw
+    elif magic == ZIP_MAGIC:
+        members = step_archive_members(fileobj)
+        if not members:
+            raise ValueError("Archive does not contain a STEP file")
+        with zipfile.ZipFile(fileobj) as archive, archive.open(member or members[0]) as raw:
+            yield raw
+    else:
+        yield fileobj
+
+
+def iter_step_lines(fileobj, errors='ignore'):
+    """Yield decoded lines from a plain, gzip (.stp.gz/.stpz) or single-member zip stream.
+
+    Decompression happens incrementally as lines are consumed, so the whole
+    decompressed file is never held in memory at once.
+    """
+    with open_step_binary(fileobj) as raw:
+        yield from io.TextIOWrapper(raw, encoding=STEP_ENCODING, errors=errors)
+
+
+def step_archive_members(fileobj):
+    """Return the STEP member names of a zip archive, or an empty list for other files"""
+    fileobj.seek(0)
+    if fileobj.read(4) != ZIP_MAGIC:
+        fileobj.seek(0)
+        return []
+    fileobj.seek(0)
+    with zipfile.ZipFile(fileobj) as archive:
+        return [
+            info.filename for info in archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(STEP_MEMBER_EXTENSIONS)
+        ]
+
+
+PRESCAN_CHUNK_SIZE = 1024 * 1024
+PRESCAN_KEYWORDS = {
+    'tolerances': b"_TOLERANCE(",
+    'datums': b"DATUM(",
+    'shape_aspects': b"SHAPE_ASPECT(",
+}
+FILE_SCHEMA_PATTERN = re.compile(r"FILE_SCHEMA\s*\(\s*\(\s*'([^']*)'", re.IGNORECASE)
+SCHEMA_PROTOCOLS = [
+    ("AP242", "AP242"),
+    ("AP203", "AP203 ed2"),
+    ("CONFIG_CONTROL_DESIGN", "AP203"),
+    ("AUTOMOTIVE_DESIGN", "AP214"),
+]
+DEFAULT_PARSE_BYTES_PER_SECOND = 10 * 1024 * 1024
+# Files estimated to take longer than this wait for the user to start extraction
+PRESCAN_CONFIRM_SECONDS = 5.0
+# Observed extraction throughput in this process, refines the pre-scan estimate
+parse_throughput = {'bytes': 0, 'seconds': 0.0}
+
+
+def estimated_parse_seconds(size_bytes):
+    """Estimate the full extraction time from the throughput observed so far"""
+    rate = (parse_throughput['bytes'] / parse_throughput['seconds']
+            if parse_throughput['seconds'] else DEFAULT_PARSE_BYTES_PER_SECOND)
+    return size_bytes / rate
+
+
+def prescan_step(fileobj):
+    """Quickly summarise a (possibly compressed or zipped) STEP file without parsing it.
+
+    Reads the HEADER's FILE_SCHEMA and counts GD&T keywords (ignoring case,
+    as the extractor does) and entity terminators with ``bytes.count`` over
+    decompressed chunks. Returns a dict
+    with the schema, protocol, keyword counts, estimated entity count,
+    decompressed size, estimated full parse time and ``has_gdt``.
+    """
+    members = step_archive_members(fileobj) or [None]
+    counts = dict.fromkeys(PRESCAN_KEYWORDS, 0)
+    entities = 0
+    size = 0
+    schema = ""
+    overlap = max(len(keyword) for keyword in PRESCAN_KEYWORDS.values()) - 1
+
+    for member in members:
+        fileobj.seek(0)
+        with open_step_binary(fileobj, member) as raw:
+            tail = b""
+            while chunk := raw.read(PRESCAN_CHUNK_SIZE):
+                if size == 0 and not schema:
+                    header = FILE_SCHEMA_PATTERN.search((tail + chunk).decode(STEP_ENCODING, 'ignore'))
+                    schema = header.group(1) if header else ""
+                # Carry a short tail so keywords split across chunks are counted once
+                window = tail + chunk.upper()
+                for key, keyword in PRESCAN_KEYWORDS.items():
+                    counts[key] += window.count(keyword) - tail.count(keyword)
+                entities += chunk.count(b";")
+                size += len(chunk)
+                tail = window[-overlap:]
+
+    protocol = next((label for prefix, label in SCHEMA_PROTOCOLS
+                     if schema.upper().startswith(prefix)), schema or "Unknown")
+    return {
+        'schema': schema,
+        'protocol': protocol,
+        **counts,
+        'entities': entities,
+        'size_bytes': size,
+        'estimated_seconds': estimated_parse_seconds(size),
+        'has_gdt': bool(counts['tolerances'] or counts['datums']),
     }
-if 'analysis_results' not in st.session_state:
-    st.session_state.analysis_results = {}
 
 
-def extract_tolerance_table(text):
-    """Extract tolerance values and datums from STEP/text file with enhanced error handling"""
+def extract_from_upload(uploaded_file, cancel_event=None, engine=None):
+    """Extract tolerance rows from an uploaded plain, compressed or zipped STEP file.
+
+    Zip archives holding several parts are processed concurrently, one worker
+    per member, and the rows are returned in archive order. Statistics are
+    computed per file while extracting and merged. Every file gets its own
+    ParseBudget; returns ``(rows, stats, truncated)`` where ``truncated`` lists
+    the reasons any file stopped early. ``engine`` is passed on to
+    ``extract_tolerance_table``.
+    """
+    errors = 'strict' if uploaded_file.type == "text/plain" else 'ignore'
+    data = uploaded_file.getvalue()
+    members = step_archive_members(BytesIO(data))
+
+    if len(members) <= 1:
+        budget = ParseBudget(cancel_event=cancel_event)
+        rows = extract_tolerance_table(iter_step_lines(BytesIO(data), errors), budget, engine)
+        return rows, ToleranceStats.from_rows(rows), [budget.truncated] if budget.truncated else []
+
+    ctx = get_script_run_ctx()
+
+    def extract_member(name):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        budget = ParseBudget(cancel_event=cancel_event)
+        # Each worker opens its own handle, ZipFile objects are not thread safe
+        with zipfile.ZipFile(BytesIO(data)) as archive, archive.open(name) as member:
+            rows = extract_tolerance_table(
+                io.TextIOWrapper(member, encoding=STEP_ENCODING, errors='ignore'), budget, engine)
+        return rows, ToleranceStats.from_rows(rows), budget.truncated and f"{name}: {budget.truncated}"
+
+    with ThreadPoolExecutor(max_workers=min(len(members), os.cpu_count() or 1)) as pool:
+        member_results = list(pool.map(extract_member, members))
+
+    stats = ToleranceStats()
+    for _, member_stats, _ in member_results:
+        stats.merge(member_stats)
+    return ([row for rows, _, _ in member_results for row in rows], stats,
+            [reason for _, _, reason in member_results if reason])
+
+
+class StepRef(str):
+    """An entity instance reference such as ``#12`` inside parsed parameters"""
+
+
+STEP_TOKEN_PATTERN = re.compile(
+    r"\s*(?:(?P<string>'(?:[^']|'')*')|(?P<ref>#\d+)|(?P<enum>\.[A-Za-z0-9_]+\.)"
+    r"|(?P<keyword>!?[A-Za-z_][A-Za-z0-9_]*)|(?P<number>[-+]?[0-9][0-9.]*(?:[Ee][-+]?[0-9]+)?)"
+    r"|(?P<punct>[$*(),;=]))")
+
+
+def parse_step_entity(line):
+    """Parse a ``#id=...;`` instance line into ``{ENTITY_NAME: [params]}``.
+
+    Simple instances give a single key, complex instances ``(A(...)B(...))``
+    give one key per partial entity. Strings are ``str``, references are
+    ``StepRef``, lists are ``list`` and typed values such as
+    ``LENGTH_MEASURE(0.05)`` are ``(name, [params])`` tuples.
+    """
+    return parse_step_tokens([(m.lastgroup, m.group(m.lastgroup))
+                              for m in STEP_TOKEN_PATTERN.finditer(line, line.find('=') + 1)])
+
+
+def parse_step_tokens(tokens):
+    """Build the ``parse_step_entity`` structure from ``(kind, text)`` tokens after the ``=``"""
+    position = 0
+
+    def parse_value():
+        nonlocal position
+        kind, token = tokens[position]
+        position += 1
+        if kind == 'string':
+            return token[1:-1].replace("''", "'")
+        if kind == 'ref':
+            return StepRef(token)
+        if kind == 'number':
+            return float(token)
+        if kind == 'keyword':
+            return (token.upper(), parse_list())
+        if token == '(':
+            position -= 1
+            return parse_list()
+        return None if token == '$' else token
+
+    def parse_list():
+        nonlocal position
+        values = []
+        position += 1  # opening parenthesis
+        while position < len(tokens) and tokens[position][1] != ')':
+            if tokens[position][1] == ',':
+                position += 1
+                continue
+            values.append(parse_value())
+        position += 1  # closing parenthesis
+        return values
+
     try:
-        lines = text.splitlines()
-        # Build a dictionary mapping entity IDs to their lines
-        line_dict = {
-            re.match(r"(#\d+)\s*=", line).group(1): line.strip()
-            for line in lines if re.match(r"(#\d+)\s*=", line)
+        if tokens and tokens[0][0] == 'keyword':
+            name, params = parse_value()
+            return {name: params}
+        return {name: params for name, params in parse_list()}
+    except (IndexError, ValueError, TypeError):
+        return {}
+
+
+PART21_SPACE = b" \t\r\n\f\v"
+PART21_DIGITS = b"0123456789"
+PART21_KEYWORD_START = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_"
+PART21_KEYWORD_CHARS = PART21_KEYWORD_START + PART21_DIGITS
+PART21_NUMBER_CHARS = PART21_DIGITS + b"."
+PART21_PUNCTUATION = b"$*(),;="
+PART21_CHUNK_BYTES = 256 * 1024
+
+
+def part21_span(data, pos, chars):
+    """Return the end of the run of bytes from ``chars`` that starts at ``pos``"""
+    stop = pos
+    while True:
+        # lstrip over a short window measures the run without a Python loop per byte
+        window = data[stop:stop + 64]
+        rest = window.lstrip(chars)
+        stop += len(window) - len(rest)
+        if rest or not window:
+            return stop
+
+
+def lex_part21(data, pos=0):
+    """Tokenize Part 21 bytes into the ``(kind, text)`` tokens of ``STEP_TOKEN_PATTERN``.
+
+    A hand-written state machine over a bytes-like object: strings (with
+    ``''`` escapes; ``\\X2\\``-style directives are kept verbatim), references,
+    enumerations, keywords, numbers and punctuation. Comments are skipped,
+    as are characters that start no token, so the result matches the regex
+    tokenizer on well-formed input.
+    """
+    data = bytes(data)
+    tokens = []
+    end = len(data)
+    while pos < end:
+        c = data[pos]
+        if c in PART21_SPACE:
+            pos += 1
+        elif c in PART21_PUNCTUATION:
+            tokens.append(('punct', chr(c)))
+            pos += 1
+        elif c == 0x2F and data[pos + 1:pos + 2] == b"*":  # /* comment */
+            close = data.find(b"*/", pos + 2)
+            pos = end if close < 0 else close + 2
+        elif c == 0x27:  # 'string', '' is an escaped quote
+            close = data.find(b"'", pos + 1)
+            while close >= 0 and data[close + 1:close + 2] == b"'":
+                close = data.find(b"'", close + 2)
+            if close < 0:
+                pos += 1  # unterminated, like the regex tokenizer
+                continue
+            tokens.append(('string', data[pos:close + 1].decode(STEP_ENCODING, 'ignore')))
+            pos = close + 1
+        elif c == 0x23:  # #123
+            stop = part21_span(data, pos + 1, PART21_DIGITS)
+            if stop > pos + 1:
+                tokens.append(('ref', data[pos:stop].decode('ascii')))
+            pos = max(stop, pos + 1)
+        elif c == 0x2E:  # .ENUM.
+            stop = part21_span(data, pos + 1, PART21_KEYWORD_CHARS)
+            if stop > pos + 1 and stop < end and data[stop] == 0x2E:
+                tokens.append(('enum', data[pos:stop + 1].decode('ascii')))
+                pos = stop + 1
+            else:
+                pos += 1
+        elif c in PART21_KEYWORD_START or (
+                c == 0x21 and pos + 1 < end and data[pos + 1] in PART21_KEYWORD_START):
+            stop = part21_span(data, pos + 1, PART21_KEYWORD_CHARS)
+            tokens.append(('keyword', data[pos:stop].decode('ascii')))
+            pos = stop
+        elif c in PART21_DIGITS or (
+                c in b"+-" and pos + 1 < end and data[pos + 1] in PART21_DIGITS):
+            stop = part21_span(data, pos + 1, PART21_NUMBER_CHARS)
+            if stop < end and data[stop] in b"Ee":
+                exponent = stop + 1
+                if exponent < end and data[exponent] in b"+-":
+                    exponent += 1
+                if exponent < end and data[exponent] in PART21_DIGITS:
+                    stop = part21_span(data, exponent, PART21_DIGITS)
+            tokens.append(('number', data[pos:stop].decode('ascii')))
+            pos = stop
+        else:
+            pos += 1
+    return tokens
+
+
+def iter_part21_chunks(text, chunk_bytes=PART21_CHUNK_BYTES):
+    """Yield encoded chunks of ``text``: a bytes-like object, a string or an iterable of lines"""
+    if isinstance(text, (bytes, bytearray, memoryview)):
+        yield bytes(text)
+    elif isinstance(text, str):
+        yield text.encode(STEP_ENCODING)
+    else:
+        batch, size = [], 0
+        for line in text:
+            batch.append(line if line.endswith("\n") else line + "\n")
+            size += len(line)
+            if size >= chunk_bytes:
+                yield "".join(batch).encode(STEP_ENCODING)
+                batch, size = [], 0
+        if batch:
+            yield "".join(batch).encode(STEP_ENCODING)
+
+
+def iter_part21_statements(chunks):
+    """Split a stream of Part 21 byte chunks into ``;``-terminated statements.
+
+    The scan is a three-state machine (code, string, comment), so semicolons
+    inside strings or comments never end a statement. Statements may span
+    lines and chunk boundaries; the terminating ``;`` is not included.
+    """
+    code, string, comment = range(3)
+    data = b""
+    start = pos = 0
+    state = code
+    for chunk in chunks:
+        data = data[start:] + chunk
+        pos -= start
+        start = 0
+        end = len(data)
+        # Most files have no comments at all, which saves a search per statement
+        has_comments = b"/*" in data
+        semicolon = -1
+        while True:
+            if state == code:
+                if semicolon < pos:
+                    semicolon = data.find(b";", pos)
+                    if semicolon < 0:
+                        # Keep the last byte, it may be the '/' of a comment
+                        pos = max(pos, end - 1)
+                        break
+                quote = data.find(b"'", pos, semicolon)
+                comment_start = data.find(b"/*", pos, semicolon) if has_comments else -1
+                if quote >= 0 and (comment_start < 0 or quote < comment_start):
+                    state = string
+                    pos = quote + 1
+                elif comment_start >= 0:
+                    state = comment
+                    pos = comment_start + 2
+                else:
+                    yield data[start:semicolon]
+                    start = pos = semicolon + 1
+            elif state == string:
+                close = data.find(b"'", pos)
+                if close < 0 or close + 1 == end:
+                    # A quote at the very end may be the first half of ''
+                    pos = end if close < 0 else close
+                    break
+                if data[close + 1] == 0x27:
+                    pos = close + 2
+                else:
+                    pos = close + 1
+                    state = code
+            else:
+                close = data.find(b"*/", pos)
+                if close < 0:
+                    pos = max(pos, end - 1)
+                    break
+                pos = close + 2
+                state = code
+
+
+class StepEntities:
+    """Lazily parsed, memoized view of the ``#id -> line`` entity index.
+
+    ``parse`` turns one indexed line into the ``parse_step_entity`` structure.
+    """
+
+    def __init__(self, line_dict, parse=parse_step_entity):
+        self.line_dict = line_dict
+        self.parse = parse
+        self._entities = {}
+
+    def __getitem__(self, ref):
+        if ref not in self._entities:
+            line = self.line_dict.get(ref)
+            self._entities[ref] = self.parse(line) if line else {}
+        return self._entities[ref]
+
+
+def step_refs(params, index):
+    """Return the references held by ``params[index]`` (a single ref or a list)"""
+    value = params[index] if len(params) > index else None
+    if isinstance(value, StepRef):
+        return [value]
+    if isinstance(value, list):
+        return [v for v in value if isinstance(v, StepRef)]
+    return []
+
+
+def tolerance_params(entity):
+    """Return the GEOMETRIC_TOLERANCE attributes of a simple or complex tolerance instance"""
+    for name, params in entity.items():
+        if name.endswith('_TOLERANCE') and len(params) >= 4:
+            return params
+    return entity.get('GEOMETRIC_TOLERANCE', [])
+
+
+class DatumResolver:
+    """Resolve datum reference frames over the entity index.
+
+    Follows DATUM_SYSTEM -> DATUM_REFERENCE_COMPARTMENT ->
+    DATUM_REFERENCE_ELEMENT -> DATUM chains (and the older DATUM_REFERENCE
+    entities). Every entity is parsed and every node resolved at most once,
+    so datum systems shared by many tolerances cost nothing after the first.
+    """
+
+    def __init__(self, entities):
+        self.entities = entities
+        self._labels = {}
+
+    def label(self, ref):
+        """Return the datum label of a node: ``A``, ``A-B`` (common) or ``A|B|C``"""
+        if ref in self._labels:
+            return self._labels[ref]
+        self._labels[ref] = ""  # guards against reference cycles
+        entity = self.entities[ref]
+
+        if 'DATUM_SYSTEM' in entity:
+            label = "|".join(filter(None, (
+                self.label(c) for c in step_refs(entity['DATUM_SYSTEM'], 4))))
+        elif 'DATUM_REFERENCE_COMPARTMENT' in entity:
+            label = "-".join(filter(None, (
+                self.label(b) for b in step_refs(entity['DATUM_REFERENCE_COMPARTMENT'], 4))))
+        elif 'DATUM_REFERENCE_ELEMENT' in entity:
+            label = "-".join(filter(None, (
+                self.label(b) for b in step_refs(entity['DATUM_REFERENCE_ELEMENT'], 4))))
+        elif 'DATUM_REFERENCE' in entity:
+            label = "".join(self.label(d) for d in step_refs(entity['DATUM_REFERENCE'], 1))
+        elif 'DATUM' in entity:
+            params = entity['DATUM']
+            label = params[4] if len(params) > 4 and isinstance(params[4], str) else ""
+        else:
+            label = ""
+
+        self._labels[ref] = label
+        return label
+
+    def tolerance_frame(self, tol_id):
+        """Return the datum reference frame of a tolerance, or "" if it has none"""
+        entity = self.entities[tol_id]
+        if 'GEOMETRIC_TOLERANCE_WITH_DATUM_REFERENCE' in entity:
+            refs = step_refs(entity['GEOMETRIC_TOLERANCE_WITH_DATUM_REFERENCE'], 0)
+        else:
+            params = tolerance_params(entity)
+            refs = [r for value in params[4:] for r in step_refs([value], 0)]
+
+        # Older DATUM_REFERENCE entities carry their own precedence
+        def precedence(item):
+            position, ref = item
+            params = self.entities[ref].get('DATUM_REFERENCE')
+            return params[0] if params and isinstance(params[0], float) else position
+
+        ordered = [ref for _, ref in sorted(enumerate(refs), key=precedence)]
+        return "|".join(filter(None, (self.label(ref) for ref in ordered)))
+
+    def toleranced_aspect(self, tol_id):
+        """Return the id (without ``#``) of the shape aspect a tolerance applies to"""
+        refs = step_refs(tolerance_params(self.entities[tol_id]), 3)
+        return refs[0][1:] if refs else ""
+
+
+SI_PREFIX_FACTORS = {
+    'NANO': 1e-9, 'MICRO': 1e-6, 'MILLI': 1e-3, 'CENTI': 1e-2, 'DECI': 1e-1,
+    'DECA': 1e1, 'HECTO': 1e2, 'KILO': 1e3,
+}
+MILLIMETRES_PER_METRE = 1000.0
+
+
+class MeasureResolver:
+    """Resolve tolerance magnitudes to millimetres through measure and unit chains.
+
+    Handles LENGTH_MEASURE_WITH_UNIT / MEASURE_REPRESENTATION_ITEM values whose
+    unit is an SI_UNIT (with prefix) or a CONVERSION_BASED_UNIT such as INCH.
+    Unit factors and measures are memoized per entity, so the handful of unit
+    entities shared by thousands of tolerances are resolved once.
+    """
+
+    def __init__(self, entities):
+        self.entities = entities
+        self._unit_factors = {}
+        self._measures = {}
+
+    def unit_factor(self, ref):
+        """Return the millimetres per unit of a length unit entity, or None"""
+        if ref in self._unit_factors:
+            return self._unit_factors[ref]
+        self._unit_factors[ref] = None  # guards against reference cycles
+        entity = self.entities[ref]
+
+        factor = None
+        if 'SI_UNIT' in entity:
+            # SI_UNIT(prefix, name), optionally preceded by the derived dimensions
+            params = entity['SI_UNIT']
+            prefix, name = params[-2:] if len(params) >= 2 else (None, None)
+            if name == '.METRE.':
+                factor = MILLIMETRES_PER_METRE * SI_PREFIX_FACTORS.get(str(prefix).strip('.'), 1.0)
+        elif 'CONVERSION_BASED_UNIT' in entity:
+            refs = step_refs(entity['CONVERSION_BASED_UNIT'], 1)
+            factor = self.measure(refs[0]) if refs else None
+
+        self._unit_factors[ref] = factor
+        return factor
+
+    def measure(self, ref):
+        """Return the value of a measure-with-unit entity in millimetres, or None"""
+        if ref in self._measures:
+            return self._measures[ref]
+        self._measures[ref] = None
+        entity = self.entities[ref]
+
+        # Complex instances carry the attributes on whichever partial has them
+        value, unit = None, None
+        for name, params in entity.items():
+            if name == 'MEASURE_REPRESENTATION_ITEM' and len(params) >= 3:
+                value, unit = params[1:3]
+            elif name.endswith('MEASURE_WITH_UNIT') and len(params) >= 2:
+                value, unit = params[:2]
+
+        if isinstance(value, tuple):
+            value = value[1][0] if value[1] else None
+        factor = self.unit_factor(unit) if isinstance(unit, StepRef) else None
+        result = value * factor if isinstance(value, float) and factor is not None else None
+
+        self._measures[ref] = result
+        return result
+
+    def tolerance_magnitude(self, tol_id):
+        """Return a tolerance's magnitude in millimetres, or None if it has no unit chain"""
+        refs = step_refs(tolerance_params(self.entities[tol_id]), 2)
+        return self.measure(refs[0]) if refs else None
+
+
+# Keyword rules for classifying feature names, highest priority first.
+# 'aspect' labels SHAPE_ASPECT names ("" when nothing matches), 'surface' and
+# 'likely' give the Location and Surface columns (the name itself otherwise).
+LOCATION_RULES = {
+    'aspect': [
+        (["plane1"], "Plane1"),
+        (["plane2"], "Plane2"),
+        (["boss1"], "Boss1"),
+        (["top"], "top face"),
+        (["bottom"], "bottom face"),
+        (["cylindrical", "side"], "cylindrical side"),
+        (["hole"], "hole"),
+        (["slot"], "slot"),
+    ],
+    'surface': [
+        (["plane1", "top"], "top face"),
+        (["plane2", "bottom"], "bottom face"),
+        (["boss1", "cylindrical", "side"], "cylindrical side"),
+        (["cone", "conical"], "conical side"),
+        (["hole"], "hole"),
+        (["slot"], "slot"),
+    ],
+    'likely': [
+        (["plane1", "top"], "top face"),
+        (["plane2", "bottom"], "bottom face"),
+        (["boss1", "cylindrical", "side"], "curved side of the cylinder"),
+        (["cone", "conical"], "conical side"),
+        (["hole"], "hole surface"),
+        (["slot"], "slot surface"),
+        (["face"], "planar face"),
+    ],
+}
+LOCATION_RULES_PATH = os.environ.get("GDNT_LOCATION_RULES")
+
+
+class KeywordClassifier:
+    """Classify names by the highest-priority rule whose keyword they contain.
+
+    All keywords are compiled into one overlapping-match alternation, and
+    results are cached per distinct name, so cost scales with unique names
+    rather than with rows.
+    """
+
+    def __init__(self, rules, default_to_name=True, cache_size=65536):
+        self.labels = [label for _, label in rules]
+        self.default_to_name = default_to_name
+
+        keyword_rule = {}
+        for priority, (keywords, _) in enumerate(rules):
+            for keyword in keywords:
+                keyword_rule.setdefault(keyword.lower(), priority)
+        # The lookahead matches the longest keyword at each position, so fold
+        # in the priority of every shorter keyword that is a prefix of it
+        self.keyword_rule = {
+            keyword: min(rule for other, rule in keyword_rule.items() if keyword.startswith(other))
+            for keyword in keyword_rule
         }
+        alternation = "|".join(sorted(map(re.escape, keyword_rule), key=len, reverse=True))
+        self.pattern = re.compile(f"(?=({alternation}))") if alternation else None
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, name):
+        matches = self.pattern.finditer(name.lower()) if self.pattern else ()
+        priority = min((self.keyword_rule[m.group(1)] for m in matches), default=None)
+        if priority is not None:
+            return self.labels[priority]
+        return name if self.default_to_name else ""
+
+
+def load_location_classifiers(path=LOCATION_RULES_PATH):
+    """Build the location classifiers, extended by an optional JSON rules file.
+
+    The file maps 'aspect', 'surface' or 'likely' to a list of
+    ``{"keywords": [...], "label": "..."}`` rules that take priority over the
+    built-in ones.
+    """
+    rules = {kind: list(kind_rules) for kind, kind_rules in LOCATION_RULES.items()}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for kind, extra in json.load(f).items():
+                rules[kind] = [(r['keywords'], r['label']) for r in extra] + rules.get(kind, [])
+    return {
+        kind: KeywordClassifier(kind_rules, default_to_name=kind != 'aspect')
+        for kind, kind_rules in rules.items()
+    }
+
+
+LOCATION_CLASSIFIERS = load_location_classifiers()
 
-        # Enhanced regex patterns for better tolerance extraction
-        tol_pattern = re.compile(
-            r"(#\d+)\s*=\s*(CYLINDRICITY|FLATNESS|STRAIGHTNESS|ROUNDNESS|CONCENTRICITY|SYMMETRY|PERPENDICULARITY|PARALLELISM|ANGULARITY|POSITION|PROFILE_OF_LINE|PROFILE_OF_SURFACE|CIRCULAR_RUNOUT|TOTAL_RUNOUT)_TOLERANCE"
-            r"\(\s*'([^']*)'\s*,\s*''\s*,\s*(#\d+)", re.IGNORECASE
-        )
-        datum_pattern = re.compile(
-            r"#\d+\s*=\s*DATUM_FEATURE\(\s*'[^']*?\((\w)\)'", re.IGNORECASE
-        )
-        shape_aspect_pattern = re.compile(
-            r"#\d+\s*=\s*SHAPE_ASPECT\('([^']*?)\((\w)?'?,.*?#(\d+)\)"
-        )
 
-        tol_results = []
-        datum_results = {}
-        face_to_plane = {}
+PARSE_TIME_BUDGET_SECONDS = float(os.environ.get("GDNT_PARSE_TIME_BUDGET", "120"))
+PARSE_MEMORY_BUDGET_MB = float(os.environ.get("GDNT_PARSE_MEMORY_BUDGET_MB", "1024"))
+PARSE_CHECKPOINT_INTERVAL = 1024
+# Approximate interpreter overhead of each line kept in the entity index
+ENTITY_OVERHEAD_BYTES = 120
 
-        # Enhanced datum and shape aspect parsing
-        datum_letter_to_faceid = {}
-        faceid_to_name = {}
 
-        # Find all DATUM and SHAPE_ASPECT lines
-        for line in lines:
-            # Parse DATUM entity
-            m = re.match(
-                r"#\d+=DATUM\('([^']*)',\$,#\d+,\.F\.,'([A-Z])'\);", line)
+class ParseBudget:
+    """Time and memory limits for one file's extraction, with cooperative cancellation.
+
+    The extractor calls ``exhausted()`` between entities. Once a limit is hit
+    or ``cancel()`` is called it stops and returns the rows found so far, and
+    ``truncated`` holds the reason.
+    """
+
+    def __init__(self, max_seconds=PARSE_TIME_BUDGET_SECONDS,
+                 max_bytes=PARSE_MEMORY_BUDGET_MB * 1024 * 1024, cancel_event=None):
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.cancel_event = cancel_event or threading.Event()
+        self.started = time.perf_counter()
+        self.used_bytes = 0
+        self.truncated = None
+
+    def charge(self, nbytes):
+        self.used_bytes += nbytes
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def exhausted(self):
+        """Checkpoint: return True once the parse should stop, recording why"""
+        if self.truncated:
+            return True
+        if self.cancel_event.is_set():
+            self.truncated = "cancelled"
+        elif time.perf_counter() - self.started > self.max_seconds:
+            self.truncated = f"time budget of {self.max_seconds:g} s exceeded"
+        elif self.used_bytes > self.max_bytes:
+            self.truncated = f"memory budget of {self.max_bytes / 1024 / 1024:g} MB exceeded"
+        return self.truncated is not None
+
+
+TOLERANCE_TYPES = (
+    "CYLINDRICITY", "FLATNESS", "STRAIGHTNESS", "ROUNDNESS", "CONCENTRICITY", "SYMMETRY",
+    "PERPENDICULARITY", "PARALLELISM", "ANGULARITY", "POSITION", "PROFILE_OF_LINE",
+    "PROFILE_OF_SURFACE", "CIRCULAR_RUNOUT", "TOTAL_RUNOUT",
+)
+MEASURE_VALUE_KEYWORDS = ("LENGTH_MEASURE", "VALUE_REPRESENTATION_ITEM")
+# Only entities whose text contains one of these are kept in the entity index:
+# the tolerances, measures and units, datum systems and shape aspects the
+# resolvers follow. Geometry and topology, the bulk of a file, are skipped.
+INDEXED_ENTITY_KEYWORDS = ("TOLERANCE", "MEASURE", "UNIT", "DATUM", "SHAPE_ASPECT",
+                           "VALUE_REPRESENTATION_ITEM")
+EXTRACTION_ENGINE = os.environ.get("GDNT_EXTRACTION_ENGINE", "regex")
+
+
+class StepScan:
+    """What an extraction engine's single pass collects for the resolution stage.
+
+    ``line_dict`` maps ``#id`` to the text of each entity matching
+    ``INDEXED_ENTITY_KEYWORDS``;
+    ``tol_matches`` holds ``(tol_id, type, name, measure_id)``,
+    ``shape_aspect_matches`` ``(name, datum letter, plane id)`` for the legacy
+    ``'name(A'`` aspect convention, ``datum_entities`` ``(position, feature,
+    letter)`` for legacy ``DATUM('feature',$,...)`` entities, ``datum_ids``
+    the ``#id`` of every DATUM and ``face_aspects`` ``(position, aspect id,
+    name)``.
+    """
+
+    def __init__(self):
+        self.line_dict = {}
+        self.tol_matches = []
+        self.shape_aspect_matches = []
+        self.datum_entities = []
+        self.datum_ids = []
+        self.face_aspects = []
+
+    def scan_complex_tolerance(self, entity_id, statement):
+        """Collect a complex tolerance instance such as ``(GEOMETRIC_TOLERANCE(...)PARALLELISM_TOLERANCE())``.
+
+        The type comes from the ``<TYPE>_TOLERANCE`` partial, the name and
+        measure from the GEOMETRIC_TOLERANCE partial.
+        """
+        entity = self.parse_entity(statement)
+        params = entity.get('GEOMETRIC_TOLERANCE', [])
+        tol_type = next((name[:-len("_TOLERANCE")] for name in entity
+                         if name.endswith("_TOLERANCE") and name[:-len("_TOLERANCE")] in TOLERANCE_TYPES), None)
+        if (tol_type and len(params) >= 3 and isinstance(params[0], str)
+                and not isinstance(params[0], StepRef) and isinstance(params[2], StepRef)):
+            self.tol_matches.append((entity_id, tol_type, params[0], str(params[2])))
+
+
+class RegexStepScan(StepScan):
+    """Regular-expression engine: every statement is matched against patterns.
+
+    The input is split into ``;``-terminated statements by
+    ``iter_part21_statements``, so an entity may be wrapped across lines and
+    several entities may share a line. Each statement is decoded and matched
+    as one line (with its ``;``), so the patterns allow no comments inside an
+    entity.
+    """
+
+    entity_id_pattern = re.compile(r"(#\d+)\s*=")
+    # What follows the "=" of an indexed entity: "(" opens a complex instance
+    entity_kind_pattern = re.compile(r"\s*(\(|DATUM\s*\()")
+    tol_pattern = re.compile(
+        rf"(#\d+)\s*=\s*({'|'.join(TOLERANCE_TYPES)})_TOLERANCE"
+        r"\(\s*'([^']*)'\s*,\s*''\s*,\s*(#\d+)", re.IGNORECASE
+    )
+    # The lazy span is bounded so malformed lines cannot backtrack quadratically
+    shape_aspect_pattern = re.compile(
+        r"#\d+\s*=\s*SHAPE_ASPECT\('([^']*?)\((\w)?'?,.{0,1024}?#(\d+)\)"
+    )
+    datum_entity_pattern = re.compile(
+        r"#\d+=DATUM\('([^']*)',\$,#\d+,\.F\.,'([A-Z])'\);")
+    face_aspect_pattern = re.compile(
+        r"#(\d+)=SHAPE_ASPECT\('([^']*)','',#\d+,\.T\.\);")
+    measure_pattern = re.compile(
+        rf"(?:{'|'.join(MEASURE_VALUE_KEYWORDS)})\s*\(\s*([\d.]+)")
+    reference_pattern = re.compile(r"#(\d+)")
+    # Matched against the upper-cased line, much faster than re.IGNORECASE
+    indexed_entity_pattern = re.compile("|".join(INDEXED_ENTITY_KEYWORDS))
+
+    def scan(self, text, budget):
+        statements = iter_part21_statements(iter_part21_chunks(text))
+        for position, statement in enumerate(statements):
+            if position % PARSE_CHECKPOINT_INTERVAL == 0 and budget.exhausted():
+                break
+            line = statement.strip().decode(STEP_ENCODING, 'ignore') + ";"
+            id_match = self.entity_id_pattern.match(line)
+            upper = line.upper() if id_match else ""
+            if id_match and self.indexed_entity_pattern.search(upper, id_match.end()):
+                entity_id = id_match.group(1)
+                self.line_dict[entity_id] = line
+                budget.charge(len(line) + ENTITY_OVERHEAD_BYTES)
+                kind = self.entity_kind_pattern.match(line, id_match.end())
+                if kind and kind.group(1) != "(":
+                    self.datum_ids.append(entity_id)
+                elif kind and "TOLERANCE" in upper:
+                    self.scan_complex_tolerance(entity_id, line)
+            self.tol_matches.extend(self.tol_pattern.findall(line))
+            self.shape_aspect_matches.extend(
+                m.groups() for m in self.shape_aspect_pattern.finditer(line))
+
+            m = self.datum_entity_pattern.match(line)
             if m:
-                feature, letter = m.groups()
-                # Find corresponding SHAPE_ASPECT for this feature
-                for sa_line in lines:
-                    sa_m = re.match(
-                        r"#(\d+)=SHAPE_ASPECT\('([^']*)','',#\d+,\.T\.\);", sa_line)
-                    if sa_m and feature in sa_m.group(2):
-                        faceid = sa_m.group(1)
-                        datum_letter_to_faceid[letter] = faceid
-                        faceid_to_name[faceid] = feature
-
-            # Parse SHAPE_ASPECT entity
-            sa_m = re.match(
-                r"#(\d+)=SHAPE_ASPECT\('([^']*)','',#\d+,\.T\.\);", line)
+                self.datum_entities.append((position, *m.groups()))
+            sa_m = self.face_aspect_pattern.match(line)
             if sa_m:
-                faceid, feature = sa_m.groups()
-                faceid_to_name[faceid] = feature
-
-        # Enhanced shape mapping
-        for match in shape_aspect_pattern.finditer(text):
-            shape_name, datum_letter, plane_id = match.groups()
-            shape_name = shape_name.lower()
-            location = ""
-            if "plane1" in shape_name:
-                location = "Plane1"
-            elif "plane2" in shape_name:
-                location = "Plane2"
-            elif "boss1" in shape_name:
-                location = "Boss1"
-            elif "top" in shape_name:
-                location = "top face"
-            elif "bottom" in shape_name:
-                location = "bottom face"
-            elif "cylindrical" in shape_name or "side" in shape_name:
-                location = "cylindrical side"
-            elif "hole" in shape_name:
-                location = "hole"
-            elif "slot" in shape_name:
-                location = "slot"
-            face_to_plane[plane_id] = location
-            if datum_letter:
-                datum_results[datum_letter] = location
-
-        # Enhanced tolerance extraction
-        for tol_id, tol_type, tol_name, ref_id in tol_pattern.findall(text):
-            definition = line_dict.get(ref_id, "")
-            value_match = re.search(
-                r"(?:LENGTH_MEASURE|VALUE_REPRESENTATION_ITEM)\s*\(\s*([\d.]+)", definition
-            )
-            value = f"±{value_match.group(1)}" if value_match else "N/A"
-
-            # Enhanced label mapping
-            label_map = {
-                "ROUNDNESS": "Circularity",
-                "CYLINDRICITY": "Cylindricity",
-                "FLATNESS": "Flatness",
-                "STRAIGHTNESS": "Straightness",
-                "CONCENTRICITY": "Concentricity",
-                "SYMMETRY": "Symmetry",
-                "PERPENDICULARITY": "Perpendicularity",
-                "PARALLELISM": "Parallelism",
-                "ANGULARITY": "Angularity",
-                "POSITION": "Position",
-                "PROFILE_OF_LINE": "Profile of Line",
-                "PROFILE_OF_SURFACE": "Profile of Surface",
-                "CIRCULAR_RUNOUT": "Circular Runout",
-                "TOTAL_RUNOUT": "Total Runout"
-            }
-            label = label_map.get(tol_type.upper(), tol_type.capitalize())
-
-            # Enhanced datum mapping
-            tol_line = next((l for l in lines if tol_id in l), "")
-            ref_ids = re.findall(r"#(\d+)", tol_line)
-            datum_ref_id = ref_ids[-1] if ref_ids else ref_id
+                self.face_aspects.append((position, *sa_m.groups()))
+
+    parse_entity = staticmethod(parse_step_entity)
+
+    def measure_text(self, line):
+        """Return the literal value of the first LENGTH_MEASURE(...)-style item, or None"""
+        match = self.measure_pattern.search(line)
+        return match.group(1) if match else None
+
+    def reference_ids(self, line):
+        """Return the ids (without ``#``) of every reference in a line, its own id first"""
+        return self.reference_pattern.findall(line)
+
+
+def is_token(token, kind, text=None):
+    return token[0] == kind and (text is None or token[1] == text)
+
+
+class LexerStepScan(StepScan):
+    """Statement-oriented engine built on the hand-written Part 21 lexer.
+
+    The input is split into statements by ``iter_part21_statements``, so
+    entities may span lines, whitespace may appear between any tokens and
+    comments are ignored. Only the entity name
+    is read during the scan; statements are tokenized by ``lex_part21`` when
+    they are candidates or when the resolvers ask for them. Indexed entities
+    are kept as bytes.
+    """
+
+    tolerance_keywords = frozenset(f"{t}_TOLERANCE".encode() for t in TOLERANCE_TYPES)
+    indexed_entity_pattern = re.compile("|".join(INDEXED_ENTITY_KEYWORDS).encode())
+
+    def __init__(self):
+        super().__init__()
+        # Tokens of the statements the resolution stage has asked about
+        self._tokens = {}
+
+    def tokens(self, statement):
+        if statement not in self._tokens:
+            self._tokens[statement] = lex_part21(statement)
+        return self._tokens[statement]
+
+    def scan(self, text, budget):
+        for position, statement in enumerate(iter_part21_statements(iter_part21_chunks(text))):
+            if position % PARSE_CHECKPOINT_INTERVAL == 0 and budget.exhausted():
+                break
+            statement = statement.strip()
+            equals = statement.find(b"=")
+            if equals < 0 or statement[:1] != b"#" or not statement[1:equals].rstrip().isdigit():
+                continue
+            if not self.indexed_entity_pattern.search(statement.upper(), equals + 1):
+                continue
+            entity_id = statement[:equals].rstrip().decode('ascii')
+            self.line_dict[entity_id] = statement
+            budget.charge(len(statement) + ENTITY_OVERHEAD_BYTES)
+
+            paren = statement.find(b"(", equals)
+            name = statement[equals + 1:paren].strip() if paren >= 0 else b""
+            if name == b"SHAPE_ASPECT":
+                self.scan_shape_aspect(position, entity_id, statement, equals)
+            elif name == b"DATUM":
+                self.datum_ids.append(entity_id)
+                self.scan_datum(position, statement, equals)
+            elif name.upper() in self.tolerance_keywords:
+                self.scan_tolerance(entity_id, statement, equals)
+            elif not name and b"TOLERANCE" in statement.upper():
+                self.scan_complex_tolerance(entity_id, statement)
+
+    def scan_tolerance(self, entity_id, statement, equals):
+        tokens = lex_part21(statement, equals + 1)
+        if (len(tokens) >= 7 and is_token(tokens[1], 'punct', '(')
+                and is_token(tokens[2], 'string') and is_token(tokens[3], 'punct', ',')
+                and is_token(tokens[4], 'string', "''") and is_token(tokens[5], 'punct', ',')
+                and is_token(tokens[6], 'ref')):
+            keyword = tokens[0][1]
+            name = tokens[2][1][1:-1].replace("''", "'")
+            self.tol_matches.append((entity_id, keyword[:-len("_TOLERANCE")], name, tokens[6][1]))
+
+    def scan_shape_aspect(self, position, entity_id, statement, equals):
+        tokens = lex_part21(statement, equals + 1)
+        if (len(tokens) == 10 and is_token(tokens[2], 'string') and is_token(tokens[4], 'string', "''")
+                and is_token(tokens[6], 'ref') and is_token(tokens[8], 'enum', '.T.')
+                and all(is_token(tokens[i], 'punct', p) for i, p in ((1, '('), (3, ','), (5, ','), (7, ','), (9, ')')))):
+            self.face_aspects.append((position, entity_id[1:], tokens[2][1][1:-1].replace("''", "'")))
+
+        legacy = legacy_shape_aspect(statement[equals + 1:].decode(STEP_ENCODING, 'ignore'))
+        if legacy:
+            self.shape_aspect_matches.append(legacy)
+
+    def scan_datum(self, position, statement, equals):
+        tokens = lex_part21(statement, equals + 1)
+        if (len(tokens) == 12 and is_token(tokens[2], 'string') and is_token(tokens[4], 'punct', '$')
+                and is_token(tokens[6], 'ref') and is_token(tokens[8], 'enum', '.F.')
+                and is_token(tokens[10], 'string') and len(tokens[10][1]) == 3
+                and 'A' <= tokens[10][1][1] <= 'Z'
+                and all(is_token(tokens[i], 'punct', p) for i, p in (
+                    (1, '('), (3, ','), (5, ','), (7, ','), (9, ','), (11, ')')))):
+            self.datum_entities.append(
+                (position, tokens[2][1][1:-1].replace("''", "'"), tokens[10][1][1]))
+
+    def parse_entity(self, statement):
+        tokens = self.tokens(statement)
+        equals = next((i for i, token in enumerate(tokens) if token == ('punct', '=')), -1)
+        return parse_step_tokens(tokens[equals + 1:])
+
+    def measure_text(self, statement):
+        """Return the literal value of the first LENGTH_MEASURE(...)-style item, or None"""
+        if not statement:
+            return None
+        tokens = self.tokens(statement)
+        for position, (kind, text) in enumerate(tokens[:-2]):
+            if (kind == 'keyword' and text.endswith(MEASURE_VALUE_KEYWORDS)
+                    and tokens[position + 1][1] == '(' and tokens[position + 2][0] == 'number'
+                    and tokens[position + 2][1][0] in "0123456789"):
+                number = tokens[position + 2][1]
+                return number[:next((i for i, c in enumerate(number) if c in "Ee"), len(number))]
+        return None
+
+    def reference_ids(self, statement):
+        """Return the ids (without ``#``) of every reference in a statement, its own id first"""
+        if not statement:
+            return []
+        return [text[1:] for kind, text in self.tokens(statement) if kind == 'ref']
+
+
+def legacy_shape_aspect(body):
+    """Match ``SHAPE_ASPECT('name(A',...,#id)`` by hand, as ``RegexStepScan.shape_aspect_pattern`` does.
+
+    ``body`` is the statement text after ``=``. Returns ``(name, letter or
+    None, id)`` for the first ``(`` in the name that is followed by an
+    optional word character and a comma, with a ``#id)`` within 1024
+    characters after that comma; None otherwise.
+    """
+    body = body.lstrip()
+    if not body.startswith("SHAPE_ASPECT('"):
+        return None
+    name_start = len("SHAPE_ASPECT('")
+    name_end = body.find("'", name_start)
+    if name_end < 0:
+        return None
+    name = body[name_start:name_end]
+
+    paren = name.find("(")
+    while paren >= 0:
+        letter_at = paren + 1
+        has_letter = letter_at < len(name) and (name[letter_at].isalnum() or name[letter_at] == "_")
+        for letter_len in ((1, 0) if has_letter else (0,)):
+            after = letter_at + letter_len
+            if after < len(name):
+                comma = name_start + after if name[after] == "," else -1
+            else:
+                # The closing quote of the name, then the comma
+                comma = name_end + 1 if body[name_end + 1:name_end + 2] == "," else -1
+            if comma < 0:
+                continue
+            hash_at = body.find("#", comma + 1)
+            while 0 <= hash_at <= comma + 1 + 1024:
+                digits_end = hash_at + 1
+                while digits_end < len(body) and body[digits_end] in "0123456789":
+                    digits_end += 1
+                if digits_end > hash_at + 1 and body[digits_end:digits_end + 1] == ")":
+                    return (name[:paren], name[letter_at] if letter_len else None,
+                            body[hash_at + 1:digits_end])
+                hash_at = body.find("#", hash_at + 1)
+        paren = name.find("(", paren + 1)
+    return None
+
+
+EXTRACTION_ENGINES = {'regex': RegexStepScan, 'lexer': LexerStepScan}
+
+
+def extract_tolerance_table(text, budget=None, engine=None):
+    """Extract tolerance values and datums from STEP/text file
+
+    ``text`` is either the full file content or an iterable of lines, such as
+    the stream returned by ``iter_step_lines``. ``budget`` (a ParseBudget,
+    created from the configured limits by default) bounds the work; check its
+    ``truncated`` attribute to see whether the rows are partial. ``engine``
+    picks the scanner from ``EXTRACTION_ENGINES`` ('regex' or 'lexer'; the
+    ``GDNT_EXTRACTION_ENGINE`` setting by default). Errors reading or
+    decoding the input, such as a corrupt gzip stream, are raised rather than
+    returned as an empty table, so callers never store them as a part
+    without GD&T.
+    """
+    budget = budget or ParseBudget()
+    scan = EXTRACTION_ENGINES[engine or EXTRACTION_ENGINE]()
+    tol_results = []
+    datum_results = {}
+    face_to_plane = {}
+
+    # Enhanced datum and shape aspect parsing
+    datum_letter_to_faceid = {}
+    faceid_to_name = {}
+
+    # Single pass over the (possibly streamed) input: index the entities
+    # and collect the matches every later step works from
+    scan.scan(text, budget)
+    line_dict = scan.line_dict
+    for _, faceid, sa_name in scan.face_aspects:
+        faceid_to_name[faceid] = sa_name
+
+    # Link each DATUM to the SHAPE_ASPECT whose name contains its feature.
+    # A datum only renames an aspect that appears earlier in the file.
+    for datum_position, feature, letter in scan.datum_entities:
+        for sa_position, faceid, sa_name in scan.face_aspects:
+            if feature in sa_name:
+                datum_letter_to_faceid[letter] = faceid
+                if datum_position > sa_position:
+                    faceid_to_name[faceid] = feature
+
+    faceid_to_letter = {}
+    for letter, faceid in datum_letter_to_faceid.items():
+        faceid_to_letter.setdefault(faceid, letter)
+    entities = StepEntities(line_dict, scan.parse_entity)
+    datum_resolver = DatumResolver(entities)
+    measure_resolver = MeasureResolver(entities)
+
+    # Enhanced shape mapping
+    for shape_name, datum_letter, plane_id in scan.shape_aspect_matches:
+        location = LOCATION_CLASSIFIERS['aspect'].classify(shape_name)
+        face_to_plane[plane_id] = location
+        if datum_letter:
+            datum_results[datum_letter] = location
+
+    # Enhanced tolerance extraction
+    # Resolution work is proportional to what the scan collected, so after
+    # a truncated scan the partial set is resolved in full
+    scan_truncated = budget.truncated is not None
+    for position, (tol_id, tol_type, tol_name, ref_id) in enumerate(scan.tol_matches):
+        if (not scan_truncated and position % PARSE_CHECKPOINT_INTERVAL == 0
+                and budget.exhausted()):
+            break
+        value_text = scan.measure_text(line_dict.get(ref_id, ""))
+        value = f"±{value_text}" if value_text else "N/A"
+
+        # Prefer the unit-resolved magnitude, expressed in millimetres
+        magnitude = measure_resolver.tolerance_magnitude(tol_id)
+        if magnitude is not None and not (value_text and float(value_text) == magnitude):
+            value = f"±{np.format_float_positional(round(magnitude, 9), trim='-')}"
+
+        # Enhanced label mapping
+        label_map = {
+            "ROUNDNESS": "Circularity",
+            "CYLINDRICITY": "Cylindricity",
+            "FLATNESS": "Flatness",
+            "STRAIGHTNESS": "Straightness",
+            "CONCENTRICITY": "Concentricity",
+            "SYMMETRY": "Symmetry",
+            "PERPENDICULARITY": "Perpendicularity",
+            "PARALLELISM": "Parallelism",
+            "ANGULARITY": "Angularity",
+            "POSITION": "Position",
+            "PROFILE_OF_LINE": "Profile of Line",
+            "PROFILE_OF_SURFACE": "Profile of Surface",
+            "CIRCULAR_RUNOUT": "Circular Runout",
+            "TOTAL_RUNOUT": "Total Runout"
+        }
+        label = label_map.get(tol_type.upper(), tol_type.capitalize())
 
-            datum_letter = ""
-            location = ""
-            for letter, faceid in datum_letter_to_faceid.items():
-                if faceid == datum_ref_id:
-                    datum_letter = letter
-                    location = faceid_to_name.get(
-                        faceid, face_to_plane.get(faceid, ""))
-                    break
+        # Datum reference frame resolved through the datum graph
+        datum_letter = datum_resolver.tolerance_frame(tol_id)
+        aspect_id = datum_resolver.toleranced_aspect(tol_id)
+        location = faceid_to_name.get(aspect_id, face_to_plane.get(aspect_id, ""))
+
+        # Fallbacks for files without datum systems: the last referenced
+        # entity or a "(A)" style letter in the tolerance name
+        if not datum_letter:
+            ref_ids = scan.reference_ids(line_dict.get(tol_id, ""))
+            datum_ref_id = ref_ids[-1] if ref_ids else ref_id
+            datum_letter = faceid_to_letter.get(datum_ref_id, "")
 
             if not datum_letter:
                 tol_name_lower = tol_name.lower()
-                for d_letter in datum_results:
-                    if f"({d_letter.lower()})" in tol_name_lower:
-                        datum_letter = d_letter
-                        break
-                if datum_letter and datum_letter in datum_letter_to_faceid:
-                    faceid = datum_letter_to_faceid[datum_letter]
-                    location = faceid_to_name.get(
-                        faceid, face_to_plane.get(faceid, ""))
-                else:
-                    for key, val in face_to_plane.items():
-                        if key in ref_id or key in tol_name:
-                            location = val
-                            break
-
-            tol_results.append((label, value, datum_letter, location))
-
-        # Enhanced GD&T symbol mapping
-        gdnt_symbols = {
-            "Straightness": "─",
-            "Flatness": "□",
-            "Circularity": "○",
-            "Cylindricity": "⌀",
-            "Concentricity": "◎",
-            "Symmetry": "⌖",
-            "Perpendicularity": "⊥",
-            "Parallelism": "∥",
-            "Angularity": "∠",
-            "Position": "⊕",
-            "Profile of Line": "⌒",
-            "Profile of Surface": "⌓",
-            "Circular Runout": "↗",
-            "Total Runout": "↗↗"
+                datum_letter = next(
+                    (d for d in datum_results if f"({d.lower()})" in tol_name_lower), "")
+            if datum_letter in datum_letter_to_faceid:
+                faceid = datum_letter_to_faceid[datum_letter]
+                location = faceid_to_name.get(
+                    faceid, face_to_plane.get(faceid, ""))
+
+        tol_results.append((label, value, datum_letter, location))
+
+    # Enhanced GD&T symbol mapping
+    gdnt_symbols = {
+        "Straightness": "─",
+        "Flatness": "□",
+        "Circularity": "○",
+        "Cylindricity": "⌀",
+        "Concentricity": "◎",
+        "Symmetry": "⌖",
+        "Perpendicularity": "⊥",
+        "Parallelism": "∥",
+        "Angularity": "∠",
+        "Position": "⊕",
+        "Profile of Line": "⌒",
+        "Profile of Surface": "⌓",
+        "Circular Runout": "↗",
+        "Total Runout": "↗↗"
+    }
+
+    # Build enhanced table rows
+    table_rows = []
+    for label, value, datum, loc in tol_results:
+        symbol = gdnt_symbols.get(label, "")
+        type_with_symbol = f"{symbol} {label}" if symbol else label
+        location_str = LOCATION_CLASSIFIERS['surface'].classify(loc)
+        surface = LOCATION_CLASSIFIERS['likely'].classify(loc)
+
+        # Extract numeric value for analysis
+        numeric_value = None
+        if value != "N/A":
+            numeric_match = re.search(r"±?(\d+\.?\d*)", value)
+            if numeric_match:
+                numeric_value = float(numeric_match.group(1))
+
+        table_rows.append({
+            "Type": type_with_symbol,
+            "Value": value,
+            "Numeric_Value": numeric_value,
+            "Datum": datum,
+            "Location": location_str,
+            "Surface": surface,
+            "Category": "Tolerance"
+        })
+
+    # Enhanced datum entries: the legacy datums matched to a face, then
+    # every other DATUM entity (AP242 datums name no feature) by its label
+    datum_features = {d_letter: faceid_to_name.get(faceid, "")
+                      for d_letter, faceid in datum_letter_to_faceid.items()}
+    for datum_id in scan.datum_ids:
+        d_letter = datum_resolver.label(datum_id)
+        if d_letter and d_letter not in datum_features:
+            name = entities[datum_id]['DATUM'][0]
+            datum_features[d_letter] = name if isinstance(name, str) else ""
+
+    for d_letter, feature_name in datum_features.items():
+        location_str = LOCATION_CLASSIFIERS['surface'].classify(feature_name)
+        surface = LOCATION_CLASSIFIERS['likely'].classify(feature_name)
+
+        table_rows.append({
+            "Type": "📍 Datum",
+            "Value": d_letter,
+            "Numeric_Value": None,
+            "Datum": d_letter,
+            "Location": location_str,
+            "Surface": surface,
+            "Category": "Datum"
+        })
+
+    return table_rows
+
+
+class TDigest:
+    """Mergeable t-digest sketch for streaming quantile estimates.
+
+    While fewer than ``compression`` values have been added every centroid
+    holds a single value and quantiles match pandas' linear interpolation.
+    """
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.centroids = []  # sorted [mean, weight] pairs
+        self.buffer = []
+        self.count = 0
+
+    def add_many(self, values):
+        self.buffer.extend(float(v) for v in values)
+        self.count += len(values)
+        if len(self.buffer) > 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self._compress()
+        self.centroids = sorted(self.centroids + [list(c) for c in other.centroids])
+        self.count += other.count
+        self._compress(force=True)
+        return self
+
+    def to_dict(self):
+        """Return the sketch as JSON-serializable data, see ``from_dict``"""
+        self._compress()
+        return {'compression': self.compression, 'count': self.count,
+                'centroids': self.centroids}
+
+    @classmethod
+    def from_dict(cls, data):
+        digest = cls(data['compression'])
+        digest.centroids = [list(c) for c in data['centroids']]
+        digest.count = data['count']
+        return digest
+
+    def _k(self, q):
+        return self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+
+    def _compress(self, force=False):
+        if not self.buffer and not force:
+            return
+        centroids = np.asarray(self.centroids, dtype=float).reshape(-1, 2)
+        means = np.concatenate([centroids[:, 0], self.buffer])
+        weights = np.concatenate([centroids[:, 1], np.ones(len(self.buffer))])
+        self.buffer = []
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        if len(means) <= self.compression:
+            self.centroids = np.column_stack([means, weights]).tolist()
+            return
+
+        # Points join the current centroid, in sorted order, while its span on
+        # the k scale stays within 1. k grows with the cumulative weight, so
+        # the end of each centroid is a single binary search
+        cumulative = np.cumsum(weights)
+        k = self._k(np.minimum(cumulative / self.count, 1.0))
+        starts = []
+        start = 0
+        while start < len(means):
+            starts.append(start)
+            k_lower = k[start - 1] if start else self._k(0.0)
+            start = max(int(np.searchsorted(k, k_lower + 1, side='right')), start + 1)
+        weight_sums = np.add.reduceat(weights, starts)
+        mean_sums = np.add.reduceat(means * weights, starts)
+        self.centroids = np.column_stack([mean_sums / weight_sums, weight_sums]).tolist()
+
+    def quantile(self, q):
+        self._compress()
+        if not self.centroids:
+            return np.nan
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+
+        # Centroid centres on a 0..count-1 scale, the same scale pandas uses
+        target = q * (self.count - 1)
+        cumulative = 0.0
+        centres = []
+        for mean, weight in self.centroids:
+            centres.append(cumulative + (weight - 1) / 2)
+            cumulative += weight
+        means = [mean for mean, _ in self.centroids]
+        return float(np.interp(target, centres, means))
+
+
+class ToleranceStats:
+    """Streaming, mergeable aggregates over extracted tolerance rows.
+
+    Stats are built per file (or per batch of rows) and combined with
+    ``merge``, so corpus-wide figures cost O(files) without reloading rows.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.tightest = None
+        self.loosest = None
+        self.type_counts = Counter()
+        self.location_counts = Counter()
+        self.datum_usage = Counter()
+        self.sketch = TDigest()
+
+    @classmethod
+    def from_rows(cls, rows):
+        stats = cls()
+        stats.update(rows)
+        return stats
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build the stats of a results DataFrame with vectorized operations.
+
+        Gives the same figures as ``from_rows(df.to_dict('records'))``
+        without converting the frame to one dict per row.
+        """
+        stats = cls()
+        if 'Category' not in df:
+            return stats
+        tolerances = df[df['Category'] == 'Tolerance']
+        for counter, column in ((stats.type_counts, 'Type'), (stats.location_counts, 'Location'),
+                                (stats.datum_usage, 'Datum')):
+            # Unsorted counts keep first-appearance order, as the row loop does
+            counter.update(tolerances[column].value_counts(sort=False, dropna=False).to_dict())
+
+        values = pd.to_numeric(tolerances['Numeric_Value'], errors='coerce')
+        valued = tolerances[values.notna()]
+        batch = values.dropna().to_numpy(dtype=float)
+        if len(batch):
+            batch_mean = batch.mean()
+            stats._combine(len(batch), batch_mean, ((batch - batch_mean) ** 2).sum())
+            # argmin/argmax return the first extreme, like the strict comparisons in update
+            for attribute, position in (('tightest', batch.argmin()), ('loosest', batch.argmax())):
+                setattr(stats, attribute, {'value': float(batch[position]),
+                                           'type': valued['Type'].iat[position],
+                                           'location': valued['Location'].iat[position]})
+            stats.sketch.add_many(batch.tolist())
+        return stats
+
+    def update(self, rows):
+        """Fold a batch of table rows (dicts) into the aggregates"""
+        values = []
+        for row in rows:
+            if row['Category'] != 'Tolerance':
+                continue
+            self.type_counts[row['Type']] += 1
+            self.location_counts[row['Location']] += 1
+            self.datum_usage[row['Datum']] += 1
+
+            value = row['Numeric_Value']
+            if value is None or pd.isna(value):
+                continue
+            values.append(value)
+            extreme = {'value': value, 'type': row['Type'], 'location': row['Location']}
+            if self.tightest is None or value < self.tightest['value']:
+                self.tightest = extreme
+            if self.loosest is None or value > self.loosest['value']:
+                self.loosest = extreme
+
+        if values:
+            batch = np.asarray(values, dtype=float)
+            batch_mean = batch.mean()
+            self._combine(len(batch), batch_mean, ((batch - batch_mean) ** 2).sum())
+            self.sketch.add_many(values)
+        return self
+
+    def _combine(self, count, mean, m2):
+        # Chan et al. parallel form of Welford's update
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    def merge(self, other):
+        """Merge another ToleranceStats into this one and return self"""
+        if other.count:
+            self._combine(other.count, other.mean, other.m2)
+        if other.tightest and (self.tightest is None or other.tightest['value'] < self.tightest['value']):
+            self.tightest = other.tightest
+        if other.loosest and (self.loosest is None or other.loosest['value'] > self.loosest['value']):
+            self.loosest = other.loosest
+        self.type_counts.update(other.type_counts)
+        self.location_counts.update(other.location_counts)
+        self.datum_usage.update(other.datum_usage)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def to_dict(self):
+        """Return the aggregates as JSON-serializable data, see ``from_dict``"""
+        return {
+            'count': self.count, 'mean': self.mean, 'm2': self.m2,
+            'tightest': self.tightest, 'loosest': self.loosest,
+            'type_counts': dict(self.type_counts),
+            'location_counts': dict(self.location_counts),
+            'datum_usage': dict(self.datum_usage),
+            'sketch': self.sketch.to_dict(),
         }
 
-        # Enhanced surface type mapping
-        def get_surface_type(feature_name):
-            fname = feature_name.lower()
-            if "plane1" in fname or "top" in fname:
-                return "top face"
-            elif "plane2" in fname or "bottom" in fname:
-                return "bottom face"
-            elif "boss1" in fname or "cylindrical" in fname or "side" in fname:
-                return "cylindrical side"
-            elif "cone" in fname or "conical" in fname:
-                return "conical side"
-            elif "hole" in fname:
-                return "hole"
-            elif "slot" in fname:
-                return "slot"
-            else:
-                return feature_name
-
-        def get_likely_location(label, feature_name):
-            fname = feature_name.lower()
-            if "plane1" in fname or "top" in fname:
-                return "top face"
-            elif "plane2" in fname or "bottom" in fname:
-                return "bottom face"
-            elif "boss1" in fname or "cylindrical" in fname or "side" in fname:
-                return "curved side of the cylinder"
-            elif "cone" in fname or "conical" in fname:
-                return "conical side"
-            elif "hole" in fname:
-                return "hole surface"
-            elif "slot" in fname:
-                return "slot surface"
-            elif "face" in fname:
-                return "planar face"
-            else:
-                return feature_name
-
-        # Build enhanced table rows
-        table_rows = []
-        for label, value, datum, loc in tol_results:
-            symbol = gdnt_symbols.get(label, "")
-            type_with_symbol = f"{symbol} {label}" if symbol else label
-            location_str = get_surface_type(loc)
-            surface = get_likely_location(label, loc)
-
-            # Extract numeric value for analysis
-            numeric_value = None
-            if value != "N/A":
-                numeric_match = re.search(r"±?(\d+\.?\d*)", value)
-                if numeric_match:
-                    numeric_value = float(numeric_match.group(1))
-
-            table_rows.append({
-                "Type": type_with_symbol,
-                "Value": value,
-                "Numeric_Value": numeric_value,
-                "Datum": datum,
-                "Location": location_str,
-                "Surface": surface,
-                "Category": "Tolerance"
-            })
-
-        # Enhanced datum entries
-        for d_letter in datum_letter_to_faceid:
-            faceid = datum_letter_to_faceid[d_letter]
-            feature_name = faceid_to_name.get(faceid, "")
-            location_str = get_surface_type(feature_name)
-            surface = get_likely_location('Datum', feature_name)
-
-            table_rows.append({
-                "Type": "📍 Datum",
-                "Value": d_letter,
-                "Numeric_Value": None,
-                "Datum": d_letter,
-                "Location": location_str,
-                "Surface": surface,
-                "Category": "Datum"
-            })
-
-        return table_rows
-
-    except Exception as e:
-        st.error(f"Error parsing file: {str(e)}")
-        return []
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count, stats.mean, stats.m2 = data['count'], data['mean'], data['m2']
+        stats.tightest, stats.loosest = data['tightest'], data['loosest']
+        stats.type_counts = Counter(data['type_counts'])
+        stats.location_counts = Counter(data['location_counts'])
+        stats.datum_usage = Counter(data['datum_usage'])
+        stats.sketch = TDigest.from_dict(data['sketch'])
+        return stats
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+    def to_analysis(self):
+        """Return the analysis dict shown in the Analysis tab and exports"""
+        analysis = {}
+        if not self.type_counts:
+            return analysis
+
+        if self.count:
+            analysis['mean_tolerance'] = self.mean
+            analysis['std_tolerance'] = self.std
+            analysis['min_tolerance'] = self.tightest['value']
+            analysis['max_tolerance'] = self.loosest['value']
+            analysis['median_tolerance'] = self.quantile(0.5)
+
+        analysis['type_counts'] = dict(self.type_counts.most_common())
+        analysis['location_counts'] = dict(self.location_counts.most_common())
+        analysis['datum_usage'] = dict(self.datum_usage.most_common())
+
+        if self.count:
+            analysis['tightest_tolerance'] = dict(self.tightest)
+            analysis['loosest_tolerance'] = dict(self.loosest)
+
+        return analysis
+
+
+def value_stats_frame(stats):
+    """Return the count, mean, std and quantiles of ``stats`` as a Statistic/Value table"""
+    return pd.DataFrame({
+        'Statistic': ['Count', 'Mean', 'Std', 'Min', '25%', '50%', '75%', 'Max'],
+        'Value': [
+            stats.count,
+            stats.mean,
+            stats.std,
+            stats.tightest['value'],
+            stats.quantile(0.25),
+            stats.quantile(0.5),
+            stats.quantile(0.75),
+            stats.loosest['value']
+        ]
+    })
 
 
 def analyze_tolerances(df):
     """Perform statistical analysis on tolerance data"""
-    analysis = {}
-
-    # Filter only tolerance entries (not datums)
-    tolerance_df = df[df['Category'] == 'Tolerance'].copy()
-
-    if not tolerance_df.empty:
-        # Basic statistics
-        numeric_values = tolerance_df['Numeric_Value'].dropna()
-        if not numeric_values.empty:
-            analysis['mean_tolerance'] = numeric_values.mean()
-            analysis['std_tolerance'] = numeric_values.std()
-            analysis['min_tolerance'] = numeric_values.min()
-            analysis['max_tolerance'] = numeric_values.max()
-            analysis['median_tolerance'] = numeric_values.median()
-
-        # Count by type
-        analysis['type_counts'] = tolerance_df['Type'].value_counts().to_dict()
-
-        # Count by location
-        analysis['location_counts'] = tolerance_df['Location'].value_counts().to_dict()
-
-        # Datum usage
-        datum_usage = tolerance_df['Datum'].value_counts()
-        analysis['datum_usage'] = datum_usage.to_dict()
-
-        # Tightest and loosest tolerances
-        if not numeric_values.empty:
-            tightest_idx = numeric_values.idxmin()
-            loosest_idx = numeric_values.idxmax()
-            analysis['tightest_tolerance'] = {
-                'value': numeric_values.loc[tightest_idx],
-                'type': tolerance_df.loc[tightest_idx, 'Type'],
-                'location': tolerance_df.loc[tightest_idx, 'Location']
-            }
-            analysis['loosest_tolerance'] = {
-                'value': numeric_values.loc[loosest_idx],
-                'type': tolerance_df.loc[loosest_idx, 'Type'],
-                'location': tolerance_df.loc[loosest_idx, 'Location']
-            }
-
-    return analysis
-
-
-def create_download_link(df, filename, file_format):
-    """Create a download link for the dataframe with enhanced formats"""
+    return ToleranceStats.from_frame(df).to_analysis()
+
+
+EXCEL_CHUNK_ROWS = 5000
+ANALYSIS_SUMMARY_FIELDS = [
+    ('mean_tolerance', 'Mean tolerance'),
+    ('std_tolerance', 'Standard deviation'),
+    ('min_tolerance', 'Tightest tolerance'),
+    ('max_tolerance', 'Loosest tolerance'),
+    ('median_tolerance', 'Median tolerance'),
+]
+ANALYSIS_COUNT_SHEETS = [
+    ('type_counts', 'Type Counts', 'Type'),
+    ('location_counts', 'Location Counts', 'Location'),
+    ('datum_usage', 'Datum Usage', 'Datum'),
+]
+
+
+def write_excel_rows(worksheet, first_row, rows):
+    """Write an iterable of row sequences starting at ``first_row``; returns the next free row"""
+    row_num = first_row
+    for row in rows:
+        worksheet.write_row(row_num, 0, row)
+        row_num += 1
+    return row_num
+
+
+def write_excel_export(df, output, analysis=None, chunk_rows=EXCEL_CHUNK_ROWS):
+    """Stream ``df`` and the flattened ``analysis`` dict into an xlsx file.
+
+    The workbook runs in XlsxWriter's constant-memory mode, which flushes each
+    row to disk as soon as the next one starts, and the tolerance rows are
+    converted to Python values one chunk at a time, so memory use does not
+    grow with the number of rows.
+    """
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    header = workbook.add_format({'bold': True})
+
+    worksheet = workbook.add_worksheet('GD&T Tolerances')
+    worksheet.write_row(0, 0, list(df.columns), header)
+    row_num = 1
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows].astype(object)
+        # Blank cells instead of NaN, which xlsx cannot store as a number
+        chunk = chunk.where(chunk.notna(), None)
+        row_num = write_excel_rows(worksheet, row_num, chunk.itertuples(index=False, name=None))
+
+    if analysis:
+        summary = workbook.add_worksheet('Summary')
+        summary.write_row(0, 0, ['Metric', 'Value'], header)
+        # xlsx cannot store NaN/inf (e.g. the deviation of a single value), leave those blank
+        write_excel_rows(summary, 1, (
+            (label, analysis[key] if np.isfinite(analysis[key]) else None)
+            for key, label in ANALYSIS_SUMMARY_FIELDS if key in analysis))
+
+        for key, sheet_name, label in ANALYSIS_COUNT_SHEETS:
+            counts = workbook.add_worksheet(sheet_name)
+            counts.write_row(0, 0, [label, 'Count'], header)
+            write_excel_rows(counts, 1, analysis.get(key, {}).items())
+
+        extremes = workbook.add_worksheet('Extremes')
+        extremes.write_row(0, 0, ['Extreme', 'Type', 'Value', 'Location'], header)
+        write_excel_rows(extremes, 1, (
+            (label, entry['type'], entry['value'], entry['location'])
+            for label, entry in (('Tightest', analysis.get('tightest_tolerance')),
+                                 ('Loosest', analysis.get('loosest_tolerance')))
+            if entry))
+
+    workbook.close()
+
+
+EXPORT_MIME_TYPES = {
+    "CSV": ("csv", "text/csv"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "JSON": ("json", "application/json"),
+    "TXT": ("txt", "text/plain"),
+}
+
+
+def create_export(df, filename, file_format, analysis=None):
+    """Serialize the dataframe for ``st.download_button``; returns ``(data, file_name, mime)``.
+
+    ``analysis`` is added to Excel exports as separate summary sheets. The
+    bytes are handed to the download button as they are, without the
+    base64 copies a data-URI link would need.
+    """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    extension, mime = EXPORT_MIME_TYPES[file_format]
 
     if file_format == "CSV":
-        csv = df.to_csv(index=False)
-        b64 = base64.b64encode(csv.encode()).decode()
-        href = f'<a href="data:file/csv;base64,{b64}" download="{filename}_{timestamp}.csv" class="download-link">📥 Download CSV</a>'
+        data = df.to_csv(index=False).encode()
     elif file_format == "Excel":
         output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='GD&T Tolerances')
-            # Add analysis sheet if available
-            if hasattr(st.session_state, 'analysis_results') and st.session_state.analysis_results:
-                analysis_df = pd.DataFrame([st.session_state.analysis_results])
-                analysis_df.to_excel(writer, index=False,
-                                     sheet_name='Analysis')
-        output.seek(0)
-        b64 = base64.b64encode(output.read()).decode()
-        href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}_{timestamp}.xlsx" class="download-link">📥 Download Excel</a>'
+        write_excel_export(df, output, analysis)
+        data = output.getvalue()
     elif file_format == "JSON":
-        json_data = df.to_json(orient='records', indent=2)
-        b64 = base64.b64encode(json_data.encode()).decode()
-        href = f'<a href="data:application/json;base64,{b64}" download="{filename}_{timestamp}.json" class="download-link">📥 Download JSON</a>'
+        data = df.to_json(orient='records', indent=2).encode()
     else:  # TXT
-        txt = df.to_string(index=False)
-        b64 = base64.b64encode(txt.encode()).decode()
-        href = f'<a href="data:file/txt;base64,{b64}" download="{filename}_{timestamp}.txt" class="download-link">📥 Download TXT</a>'
+        data = df.to_string(index=False).encode()
+
+    return data, f"{filename}_{timestamp}.{extension}", mime
+
+
+RESULT_CACHE_BUDGET_MB = float(os.environ.get("GDNT_RESULT_CACHE_MB", "512"))
+MAX_PROCESSING_HISTORY = 20
+
+
+class ResultCache:
+    """Process-wide, thread-safe LRU of parsed results keyed by content hash.
+
+    Every session that uploads the same file shares one entry. Least recently
+    used entries are evicted once the estimated size exceeds ``budget_bytes``;
+    a session whose entry was evicted simply re-extracts on its next rerun.
+    Concurrent misses on one key go through ``get_or_compute``, so only one
+    of them extracts while the others wait for its result.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}  # key -> Future of the running computation
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, df, analysis, truncated=()):
+        entry = {'df': df, 'analysis': analysis, 'truncated': list(truncated),
+                 'nbytes': int(df.memory_usage(deep=True).sum())}
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)['nbytes']
+            self._entries[key] = entry
+            self.total_bytes += entry['nbytes']
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self.total_bytes > self.budget_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted['nbytes']
+        return entry
+
+    def get_or_compute(self, key, compute):
+        """Return ``(key, entry)`` from the cache, or from ``compute()`` run once per key.
+
+        ``compute`` must return ``(result_key, entry)``. Callers arriving while
+        it runs wait for the same result. If the computing caller fails or is
+        interrupted (e.g. its script is rerun), a waiter takes over.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return key, entry
+                future = self._in_flight.get(key)
+                owner = future is None
+                if owner:
+                    future = self._in_flight[key] = Future()
+
+            if not owner:
+                try:
+                    return future.result()
+                except BaseException:
+                    continue
 
-    return href
+            try:
+                result = compute()
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+
+
+@st.cache_resource
+def get_result_cache():
+    """Return the result cache shared by all sessions of this process"""
+    return ResultCache(int(RESULT_CACHE_BUDGET_MB * 1024 * 1024))
+
+
+def get_or_extract(uploaded_file, size_bytes=None):
+    """Return ``(result_key, entry)`` for an upload, extracting it on a cache miss.
+
+    Complete results are shared under the content hash, and sessions
+    uploading the same file at once wait for a single extraction. Truncated
+    results get a key of their own that only those sessions know, so later
+    uploads of the file extract it again instead of inheriting the partial
+    rows. ``size_bytes`` is the decompressed size from the pre-scan; when
+    given, the extraction time feeds the pre-scan's parse time estimate.
+    """
+    result_cache = get_result_cache()
+    content_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+    def extract():
+        start = time.perf_counter()
+        rows, file_stats, truncated = extract_from_upload(uploaded_file)
+        if not truncated:
+            if size_bytes is not None:
+                parse_throughput['seconds'] += time.perf_counter() - start
+                parse_throughput['bytes'] += size_bytes
+            # Partial results are shown but kept out of the history store
+            store_results(uploaded_file.name, content_hash, rows, stats=file_stats)
+        result_key = f"{content_hash}:partial:{uuid.uuid4().hex}" if truncated else content_hash
+        entry = result_cache.put(
+            result_key, pd.DataFrame(rows), file_stats.to_analysis(), truncated)
+        return result_key, entry
+
+    return result_cache.get_or_compute(content_hash, extract)
+
+
+def get_session_entry():
+    """Return the current session's result cache entry, or None if it has none or it was evicted"""
+    return get_result_cache().get(st.session_state.result_key) if st.session_state.result_key else None
+
+
+TABLE_COLUMNS = ['Type', 'Value', 'Datum', 'Location', 'Surface', 'Category']
+TABLE_PAGE_SIZES = [25, 50, 100, 250]
+DATUM_ROW_STYLE = 'background-color: #e8f5e8'
+FORM_TOLERANCE_ROW_STYLE = 'background-color: #fff3cd'
+FORM_TOLERANCE_SYMBOLS = "[─□○⌀]"
+
+
+def search_and_sort(df, search="", sort_by=None, ascending=True):
+    """Filter rows containing ``search`` in any text column, then sort.
+
+    Sorting by Value uses the numeric column so ±0.1 sorts after ±0.05.
+    """
+    if search:
+        mask = np.zeros(len(df), dtype=bool)
+        for column in TABLE_COLUMNS:
+            mask |= df[column].astype(str).str.contains(
+                search, case=False, regex=False).to_numpy()
+        df = df[mask]
+    if sort_by:
+        key = 'Numeric_Value' if sort_by == 'Value' else sort_by
+        df = df.sort_values(key, ascending=ascending, kind='stable', na_position='last')
+    return df
+
+
+def style_table_page(page_df):
+    """Colour the Type cells of one table page from the Category column"""
+    def type_styles(frame):
+        styles = pd.DataFrame('', index=frame.index, columns=frame.columns)
+        is_datum = frame['Category'] == 'Datum'
+        is_form = (frame['Category'] == 'Tolerance') & frame['Type'].str.contains(FORM_TOLERANCE_SYMBOLS)
+        styles['Type'] = np.where(is_datum, DATUM_ROW_STYLE,
+                                  np.where(is_form, FORM_TOLERANCE_ROW_STYLE, ''))
+        return styles
+
+    return page_df.style.apply(type_styles, axis=None)
 
 
 def create_visualizations(df):
@@ -596,7 +1976,439 @@ def create_visualizations(df):
     return fig1, fig2, fig3
 
 
+STORE_PATH = os.environ.get("GDNT_STORE_PATH", "gdnt_store.sqlite")
+# Largest store query result; the last one is kept in each session's state
+STORE_QUERY_MAX_ROWS = 5000
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS parts (
+    part_id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    ingested_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tolerances (
+    part_id INTEGER NOT NULL REFERENCES parts(part_id),
+    type TEXT NOT NULL,
+    value_text TEXT,
+    value REAL,
+    datum TEXT,
+    location TEXT,
+    surface TEXT,
+    category TEXT NOT NULL,
+    ingested_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tolerance_datums (
+    letter TEXT NOT NULL,
+    tolerance_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    location TEXT,
+    value REAL,
+    ingested_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS part_stats (
+    part_id INTEGER PRIMARY KEY REFERENCES parts(part_id),
+    stats TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS facets (
+    column_name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (column_name, value)
+) WITHOUT ROWID;
+DROP INDEX IF EXISTS idx_tol_type_datum_value;
+DROP INDEX IF EXISTS idx_tol_datum_value;
+DROP INDEX IF EXISTS idx_tol_location_value;
+DROP INDEX IF EXISTS idx_tol_value;
+CREATE INDEX IF NOT EXISTS idx_tol_type_value_ingested ON tolerances(type, value, ingested_at);
+CREATE INDEX IF NOT EXISTS idx_tol_datum_value_ingested ON tolerances(datum, value, ingested_at);
+CREATE INDEX IF NOT EXISTS idx_tol_location_value_ingested ON tolerances(location, value, ingested_at);
+CREATE INDEX IF NOT EXISTS idx_tol_value_ingested ON tolerances(value, ingested_at);
+CREATE INDEX IF NOT EXISTS idx_tol_ingested ON tolerances(ingested_at);
+CREATE INDEX IF NOT EXISTS idx_tol_datums_letter_value ON tolerance_datums(letter, value, ingested_at, tolerance_id);
+CREATE INDEX IF NOT EXISTS idx_tol_datums_letter_type_value ON tolerance_datums(letter, type, value, ingested_at, tolerance_id);
+CREATE INDEX IF NOT EXISTS idx_tol_datums_letter_location_value ON tolerance_datums(letter, location, value, ingested_at, tolerance_id);
+CREATE INDEX IF NOT EXISTS idx_tol_part ON tolerances(part_id);
+CREATE INDEX IF NOT EXISTS idx_parts_ingested ON parts(ingested_at);
+"""
+
+
+def datum_letters(frame):
+    """Return the individual datums of a frame, e.g. ``{'A', 'B', 'C'}`` for ``A|B-C``"""
+    return set(filter(None, re.split(r"[|-]", frame or "")))
+
+
+def connect_store(path=STORE_PATH):
+    """Open the file-backed tolerance store, creating the schema on first use"""
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(STORE_SCHEMA)
+    return conn
+
+
+def store_results(filename, content_hash, rows, path=STORE_PATH, stats=None):
+    """Append one part's extracted rows and its ToleranceStats to the store.
+
+    Parts are keyed by content hash, so re-processing the same file (e.g. on a
+    Streamlit rerun) is a no-op. ``stats`` defaults to the stats of ``rows``.
+    Returns True if the part was added.
+    """
+    ingested_at = datetime.now().isoformat(timespec='seconds')
+    with closing(connect_store(path)) as conn, conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO parts (filename, content_hash, ingested_at) VALUES (?, ?, ?)",
+            (filename, content_hash, ingested_at))
+        if not cursor.rowcount:
+            return False
+        part_id = cursor.lastrowid
+        stats = stats or ToleranceStats.from_rows(rows)
+        conn.execute("INSERT INTO part_stats (part_id, stats) VALUES (?, ?)",
+                     (part_id, json.dumps(stats.to_dict())))
+        # The part insert holds the write lock, so the rows get the next rowids
+        # and can be numbered up front for the datum side table
+        first_id = conn.execute("SELECT COALESCE(MAX(rowid), 0) + 1 FROM tolerances").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO tolerances (rowid, part_id, type, value_text, value, datum, location, surface, "
+            "category, ingested_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((first_id + i, part_id, row['Type'], row['Value'], row['Numeric_Value'], row['Datum'],
+              row['Location'], row['Surface'], row['Category'], ingested_at)
+             for i, row in enumerate(rows)))
+        # Frames such as A|B-C are stored whole; each datum they use also gets
+        # a row here, so a datum can be queried wherever it appears. The type,
+        # location, value and ingestion time are copied so its indexes can
+        # serve the other filters and the sort order without the tolerances
+        conn.executemany(
+            "INSERT INTO tolerance_datums (letter, tolerance_id, type, location, value, ingested_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            ((letter, first_id + i, row['Type'], row['Location'], row['Numeric_Value'], ingested_at)
+             for i, row in enumerate(rows) for letter in datum_letters(row['Datum'])))
+        # Distinct filter values are kept in a small side table so the UI
+        # does not have to scan millions of rows to populate its selectors
+        tolerance_rows = [row for row in rows if row['Category'] == 'Tolerance']
+        conn.executemany(
+            "INSERT OR IGNORE INTO facets (column_name, value) VALUES (?, ?)",
+            {(column, row[key]) for row in tolerance_rows
+             for column, key in (('type', 'Type'), ('frame', 'Datum'), ('location', 'Location'))}
+            | {('datum', letter) for row in tolerance_rows for letter in datum_letters(row['Datum'])})
+    return True
+
+
+def store_has_part(content_hash, path=STORE_PATH):
+    """Return True if a part with this content hash is already stored"""
+    with closing(connect_store(path)) as conn:
+        return conn.execute(
+            "SELECT 1 FROM parts WHERE content_hash = ?", (content_hash,)).fetchone() is not None
+
+
+def query_store(tol_type=None, datum=None, location=None, max_value=None, min_value=None,
+                since=None, limit=1000, frame=None, path=STORE_PATH):
+    """Query stored tolerances across all ingested parts.
+
+    ``datum`` matches every tolerance whose frame uses that datum (``A``
+    matches ``A``, ``A|B|C`` and ``A-B``), while ``frame`` matches the whole
+    reference frame exactly. ``max_value``/``min_value`` are inclusive bounds
+    on the numeric tolerance and ``since`` is a datetime limiting results to
+    parts ingested after it.
+    Returns ``(total_matches, df)`` with at most ``limit`` rows, tightest first
+    and rows without a numeric value (datums, unparsed values) last.
+    """
+    source, key = "tolerances t", "t"
+    clauses, params = [], []
+    # Most selective first: only the first of these may drive the query, the
+    # unary + on the others keeps SQLite from picking a broader index
+    filters = [('t.location', location), ('t.datum', frame), ('t.type', tol_type)]
+    count_source = source
+    if datum is not None:
+        # Driven from the datum side table, which also holds the type and
+        # location, so its (letter, location or type, value) indexes serve
+        # those filters and the sort order. The tolerances are only joined
+        # for the frame and the selected columns
+        source, key = "tolerance_datums d JOIN tolerances t ON t.rowid = d.tolerance_id", "d"
+        clauses.append("d.letter = ?")
+        params.append(datum)
+        filters = [('d.location', location), ('d.type', tol_type), ('+t.datum', frame)]
+        count_source = source if frame is not None else "tolerance_datums d"
+    filters = [(column, value) for column, value in filters if value is not None]
+    for position, (column, value) in enumerate(filters):
+        clauses.append(f"{'+' if position and column[0] != '+' else ''}{column} = ?")
+        params.append(value)
+    if max_value is not None:
+        clauses.append(f"{key}.value <= ?")
+        params.append(max_value)
+    if min_value is not None:
+        clauses.append(f"{key}.value >= ?")
+        params.append(min_value)
+    if since is not None:
+        clauses.append(f"{key}.ingested_at >= ?")
+        params.append(since.isoformat(timespec='seconds'))
+
+    def where(*extra):
+        conditions = clauses + list(extra)
+        return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    select = (
+        f"SELECT p.filename AS Part, t.type AS Type, t.value_text AS Value, t.value AS Numeric_Value, "
+        f"t.datum AS Datum, t.location AS Location, t.surface AS Surface, t.category AS Category, "
+        f"t.ingested_at AS Ingested "
+        f"FROM {source} JOIN parts p ON p.part_id = t.part_id")
+    with closing(connect_store(path)) as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM {count_source} {where()}", params).fetchone()[0]
+        # Rows without a value are fetched separately: ordering them last in
+        # one query would keep SQLite from reading the value indexes in order
+        cursor = conn.execute(
+            f"{select} {where(f'{key}.value IS NOT NULL')} ORDER BY {key}.value LIMIT ?",
+            params + [limit])
+        columns = [description[0] for description in cursor.description]
+        records = cursor.fetchall()
+        if len(records) < limit:
+            records += conn.execute(
+                f"{select} {where(f'{key}.value IS NULL')} LIMIT ?",
+                params + [limit - len(records)]).fetchall()
+    return total, pd.DataFrame.from_records(records, columns=columns)
+
+
+def store_stats(path=STORE_PATH, since=None):
+    """Merge the stored per-part stats into corpus-wide ToleranceStats.
+
+    Only the small per-part aggregates are read, never the tolerance rows, so
+    this costs O(parts). Returns ``(stats, parts)``.
+    """
+    stats = ToleranceStats()
+    parts = 0
+    with closing(connect_store(path)) as conn:
+        for (part_stats,) in conn.execute(
+                "SELECT s.stats FROM part_stats s JOIN parts p ON p.part_id = s.part_id "
+                "WHERE p.ingested_at >= ?",
+                (since.isoformat(timespec='seconds') if since else "",)):
+            stats.merge(ToleranceStats.from_dict(json.loads(part_stats)))
+            parts += 1
+    return stats, parts
+
+
+def store_facets(path=STORE_PATH):
+    """Return the distinct types, datums, datum frames and locations present in the store"""
+    with closing(connect_store(path)) as conn:
+        return {
+            column: [r[0] for r in conn.execute(
+                "SELECT value FROM facets WHERE column_name = ? ORDER BY value", (column,))]
+            for column in ('type', 'datum', 'frame', 'location')
+        }
+
+
+def render_store_query():
+    """Render the query form over the persistent tolerance store.
+
+    The store is only queried when the form is submitted, not on every rerun
+    of the page; the last result, at most ``STORE_QUERY_MAX_ROWS`` rows, is
+    kept in the session and shown until the next submit.
+    """
+    st.subheader("🗄️ Historical Parts Store")
+    facets = store_facets()
+    if not facets['type']:
+        st.info("No parts stored yet. Processed files are added automatically.")
+        return
+    render_store_stats()
+
+    with st.form("store_query_form"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            tol_type = st.selectbox("Type", ['All'] + facets['type'], key='store_type')
+            max_value = st.number_input(
+                "Tighter than (≤, 0 = any)", min_value=0.0, value=0.0,
+                step=0.001, format="%.4f", key='store_max_value')
+        with col2:
+            datum = st.selectbox("Datum", ['All'] + facets['datum'], key='store_datum')
+            frame = st.selectbox("Datum frame", ['All'] + [f for f in facets['frame'] if f],
+                                 key='store_frame')
+            days = st.number_input("Ingested within last N days (0 = all)",
+                                   min_value=0, value=365, key='store_days')
+        with col3:
+            location = st.selectbox("Location", ['All'] + facets['location'], key='store_location')
+            limit = st.number_input("Max rows", min_value=10, max_value=STORE_QUERY_MAX_ROWS,
+                                    value=1000, step=100, key='store_limit')
+        submitted = st.form_submit_button("🔎 Query Store")
+
+    if submitted:
+        start = datetime.now()
+        total, df = query_store(
+            tol_type=None if tol_type == 'All' else tol_type,
+            datum=None if datum == 'All' else datum,
+            frame=None if frame == 'All' else frame,
+            location=None if location == 'All' else location,
+            max_value=max_value or None,
+            since=datetime.now() - timedelta(days=days) if days else None,
+            limit=min(int(limit), STORE_QUERY_MAX_ROWS))
+        st.session_state.store_query = (total, df, (datetime.now() - start).total_seconds())
+
+    if st.session_state.store_query is None:
+        st.caption("Choose filters and press Query Store to search the stored parts.")
+        return
+    total, df, elapsed = st.session_state.store_query
+    st.caption(f"{total} matching tolerances ({elapsed * 1000:.0f} ms), showing {len(df)}")
+    st.dataframe(df, use_container_width=True, hide_index=True)
+
+
+def render_store_stats():
+    """Render corpus-wide statistics merged from the stored per-part stats"""
+    with st.expander("📊 Corpus statistics"):
+        if not st.button("Merge stored part statistics", key='store_stats_button'):
+            return
+        stats, parts = store_stats()
+        st.caption(f"Merged from {parts} stored parts")
+        if stats.count:
+            st.dataframe(value_stats_frame(stats), use_container_width=True, hide_index=True)
+        if stats.type_counts:
+            st.bar_chart(pd.Series(dict(stats.type_counts.most_common()), name='count'))
+
+
+def apply_filters(df):
+    """Apply the session's sidebar filters to the results"""
+    filtered_df = df.copy()
+
+    if st.session_state.filter_settings['type_filter'] != 'All':
+        filtered_df = filtered_df[filtered_df['Type'] ==
+                                  st.session_state.filter_settings['type_filter']]
+
+    if st.session_state.filter_settings['location_filter'] != 'All':
+        filtered_df = filtered_df[filtered_df['Location'] ==
+                                  st.session_state.filter_settings['location_filter']]
+
+    if st.session_state.filter_settings['datum_filter'] != 'All':
+        filtered_df = filtered_df[filtered_df['Datum'] ==
+                                  st.session_state.filter_settings['datum_filter']]
+
+    # Apply range filter if exists
+    if 'range_filter' in st.session_state.filter_settings:
+        range_min, range_max = st.session_state.filter_settings['range_filter']
+        filtered_df = filtered_df[
+            (filtered_df['Numeric_Value'].isna()) |
+            ((filtered_df['Numeric_Value'] >= range_min) &
+             (filtered_df['Numeric_Value'] <= range_max))
+        ]
+
+    return filtered_df
+
+
+COMPARE_KEY_COLUMNS = ['Category', 'Type', 'Datum', 'Location', 'Surface']
+COMPARE_STATUSES = ['added', 'removed', 'tightened', 'loosened', 'changed', 'unchanged']
+
+
+def compare_revisions(old_df, new_df):
+    """Match the rows of two revisions and classify every change.
+
+    Rows are matched on (Category, Type, Datum, Location, Surface). Surface
+    is derived from the same feature name as Location, so in effect the key
+    is the tolerance type, datum frame and location. Repeated keys are
+    paired in order of value, tightest first. The join is a hash join on
+    integer key codes and deltas are computed with NumPy. Returns a
+    DataFrame with the key columns, Old_Value, New_Value, Delta and Status:
+    added, removed, tightened, loosened, changed (a value without a number
+    on either side, such as N/A, that differs) or unchanged. A revision
+    without rows, even without columns, counts as empty.
+    """
+    # Files without GD&T give a DataFrame without any columns
+    columns = COMPARE_KEY_COLUMNS + ['Value', 'Numeric_Value']
+    old_df = old_df.reindex(columns=columns)
+    new_df = new_df.reindex(columns=columns)
+    old_df = old_df.sort_values('Numeric_Value', kind='stable')
+    new_df = new_df.sort_values('Numeric_Value', kind='stable')
+    keys = pd.concat([old_df[COMPARE_KEY_COLUMNS], new_df[COMPARE_KEY_COLUMNS]], ignore_index=True)
+    codes = keys.groupby(COMPARE_KEY_COLUMNS, sort=False, dropna=False).ngroup().to_numpy()
+
+    def keyed(df, key_codes, side):
+        frame = pd.DataFrame({
+            'key': key_codes,
+            f'{side}_Text': df['Value'].to_numpy(),
+            f'{side}_Value': df['Numeric_Value'].to_numpy(dtype=float),
+        })
+        frame['occurrence'] = frame.groupby('key').cumcount()
+        return frame
+
+    merged = keyed(old_df, codes[:len(old_df)], 'Old').merge(
+        keyed(new_df, codes[len(old_df):], 'New'), on=['key', 'occurrence'], how='outer')
+
+    old_values = merged['Old_Value'].to_numpy()
+    new_values = merged['New_Value'].to_numpy()
+    in_old = merged['Old_Text'].notna().to_numpy()
+    in_new = merged['New_Text'].notna().to_numpy()
+    delta = new_values - old_values
+    text_changed = merged['Old_Text'].to_numpy() != merged['New_Text'].to_numpy()
+    status = np.select(
+        [~in_old, ~in_new, delta < 0, delta > 0, np.isnan(delta) & text_changed],
+        COMPARE_STATUSES[:-1],
+        default='unchanged')
+
+    first_rows = keys.groupby(codes, sort=False).head(1)
+    key_values = first_rows.set_index(codes[first_rows.index]).loc[merged['key']]
+    diff = key_values.reset_index(drop=True)
+    diff['Old_Value'] = merged['Old_Text'].to_numpy()
+    diff['New_Value'] = merged['New_Text'].to_numpy()
+    diff['Delta'] = delta
+    diff['Status'] = status
+    return diff
+
+
+def render_compare(current_df):
+    """Render the revision comparison against an uploaded previous revision"""
+    st.subheader("🔀 Compare Revisions")
+    previous_file = st.file_uploader(
+        "Previous revision",
+        type=['step', 'stp', 'txt', 'gz', 'stpz', 'zip'],
+        key='compare_upload',
+        help="The current file is compared against this earlier revision")
+    if previous_file is None:
+        st.info("Upload an earlier revision of this part to see what changed")
+        return
+
+    # Reuse this session's entry, which may be a partial one only it can see
+    previous = None
+    if st.session_state.get('compare_file_id') == previous_file.file_id:
+        previous = get_result_cache().get(st.session_state.compare_key)
+    if previous is None:
+        with st.spinner("Processing previous revision..."):
+            try:
+                st.session_state.compare_key, previous = get_or_extract(previous_file)
+            except Exception as e:
+                st.error(f"❌ Error processing previous revision: {str(e)}")
+                return
+            st.session_state.compare_file_id = previous_file.file_id
+    start = time.perf_counter()
+    diff = compare_revisions(previous['df'], current_df)
+    elapsed = time.perf_counter() - start
+
+    counts = diff['Status'].value_counts()
+    columns = st.columns(len(COMPARE_STATUSES))
+    for column, status, icon in zip(columns, COMPARE_STATUSES, ['➕', '➖', '🎯', '📐', '✏️', '⏸️']):
+        column.metric(f"{icon} {status.title()}", int(counts.get(status, 0)))
+    st.caption(f"Compared {len(previous['df'])} → {len(current_df)} entries in {elapsed * 1000:.1f} ms")
+
+    show_unchanged = st.checkbox("Show unchanged entries", value=False, key='compare_unchanged')
+    visible = diff if show_unchanged else diff[diff['Status'] != 'unchanged']
+    st.dataframe(visible, use_container_width=True, hide_index=True)
+
+    export_format = st.selectbox("Export Format", ["CSV", "Excel", "JSON", "TXT"], key='compare_format')
+    if st.button("📥 Export Comparison"):
+        name = os.path.splitext(st.session_state.filename)[0] or "gdt"
+        data, file_name, mime = create_export(visible, f"{name}_comparison", export_format)
+        st.download_button(f"📥 Download {export_format}", data, file_name=file_name, mime=mime,
+                           on_click='ignore', key='compare_download')
+
+
+def render_prescan(prescan):
+    """Show the pre-scan summary of the uploaded file"""
+    st.markdown("### 🔎 Pre-scan")
+    st.caption(
+        f"Schema: **{prescan['protocol']}** · "
+        f"{prescan['size_bytes'] / 1024 / 1024:.1f} MB · "
+        f"~{prescan['entities']:,} entities")
+    st.caption(
+        f"{prescan['tolerances']:,} tolerances · {prescan['datums']:,} datums · "
+        f"{prescan['shape_aspects']:,} shape aspects")
+    st.caption(f"Estimated extraction time: {prescan['estimated_seconds']:.1f} s")
+
+
 def main():
+    setup_page()
+
     # Enhanced header with logos and subtitle
     col1, col2, col3 = st.columns([1, 3, 1])
 
@@ -630,13 +2442,19 @@ def main():
     # Sidebar tabs
     tab1, tab2, tab3 = st.sidebar.tabs(["📁 Upload", "🔍 Filter", "📊 Export"])
 
+    # The session's entry is fetched once and held for the whole run, so
+    # another session evicting it cannot remove the results halfway through
+    result_entry = get_session_entry()
+
     with tab1:
         # File upload with enhanced styling
         st.markdown("### File Upload")
         uploaded_file = st.file_uploader(
             "Select STEP or Text File",
-            type=['step', 'stp', 'txt'],
-            help="Upload a STEP file containing GD&T tolerance data"
+            type=['step', 'stp', 'txt', 'gz', 'stpz', 'zip'],
+            key='step_upload',
+            help="Upload a STEP file containing GD&T tolerance data. "
+                 "Compressed (.stp.gz, .stpz) and zipped STEP files are read directly"
         )
 
         # Processing options
@@ -647,37 +2465,57 @@ def main():
         # Process file
         if uploaded_file is not None:
             try:
-                with st.spinner("Processing file..."):
-                    if uploaded_file.type == "text/plain":
-                        content = str(uploaded_file.read(), "utf-8")
+                # Cheap pre-scan, once per upload, before any full extraction
+                if st.session_state.get('prescan_file_id') != uploaded_file.file_id:
+                    st.session_state.prescan = prescan_step(BytesIO(uploaded_file.getvalue()))
+                    st.session_state.prescan_file_id = uploaded_file.file_id
+                prescan = st.session_state.prescan
+                render_prescan(prescan)
+
+                # Reruns with the same upload reuse the session's cached entry
+                if uploaded_file.file_id != st.session_state.get('result_file_id') or result_entry is None:
+                    if not prescan['has_gdt']:
+                        st.warning("⚠️ No GD&T tolerances or datums found, skipping extraction")
+                        st.session_state.result_key = None
+                        result_entry = None
+                    elif (prescan['estimated_seconds'] > PRESCAN_CONFIRM_SECONDS
+                          and not st.button("▶️ Run full extraction")):
+                        st.info("Large file: review the pre-scan above, then start the extraction")
                     else:
-                        content = str(uploaded_file.read(),
-                                      "utf-8", errors='ignore')
-
-                    st.session_state.filename = uploaded_file.name
-                    st.session_state.results_data = extract_tolerance_table(
-                        content)
-
-                    # Add to processing history
-                    st.session_state.processing_history.append({
-                        'filename': uploaded_file.name,
-                        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        'entries': len(st.session_state.results_data)
-                    })
-
-                    # Auto-analyze if enabled
-                    if auto_analyze and st.session_state.results_data:
-                        df = pd.DataFrame(st.session_state.results_data)
-                        st.session_state.analysis_results = analyze_tolerances(
-                            df)
-
-                st.success(f"✅ Successfully processed: {uploaded_file.name}")
-                st.info(
-                    f"📊 Extracted {len(st.session_state.results_data)} entries")
+                        with st.spinner("Processing file..."):
+                            result_key, result_entry = get_or_extract(
+                                uploaded_file, prescan['size_bytes'])
+
+                            st.session_state.result_key = result_key
+                            st.session_state.result_file_id = uploaded_file.file_id
+                            st.session_state.filename = uploaded_file.name
+
+                            # Add to processing history
+                            st.session_state.processing_history.append({
+                                'filename': uploaded_file.name,
+                                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                'entries': len(result_entry['df'])
+                            })
+                            del st.session_state.processing_history[:-MAX_PROCESSING_HISTORY]
+
+                            # Auto-analyze if enabled
+                            if auto_analyze and not result_entry['df'].empty:
+                                st.session_state.analysis_results = result_entry['analysis']
+
+                if result_entry is not None and st.session_state.get('result_file_id') == uploaded_file.file_id:
+                    truncated = result_entry['truncated']
+                    if truncated:
+                        st.warning("⚠️ Extraction truncated, showing partial results: "
+                                   + "; ".join(truncated))
+                    st.success(f"✅ Successfully processed: {uploaded_file.name}")
+                    st.info(
+                        f"📊 Extracted {len(result_entry['df'])} entries")
 
             except Exception as e:
                 st.error(f"❌ Error processing file: {str(e)}")
-                st.session_state.results_data = []
+                st.session_state.result_key = None
+                st.session_state.result_file_id = None
+                result_entry = None
 
         # Processing history
         if st.session_state.processing_history:
@@ -686,11 +2524,13 @@ def main():
                 with st.expander(f"{entry['filename']} - {entry['timestamp']}"):
                     st.write(f"Entries extracted: {entry['entries']}")
 
+    results_df = result_entry['df'] if result_entry is not None else pd.DataFrame()
+
     with tab2:
         # Enhanced filtering options
         st.markdown("### 🔍 Filter Options")
-        if st.session_state.results_data:
-            df = pd.DataFrame(st.session_state.results_data)
+        if not results_df.empty:
+            df = results_df
 
             # Type filter
             type_options = ['All'] + sorted(df['Type'].unique().tolist())
@@ -752,7 +2592,7 @@ def main():
     with tab3:
         # Enhanced export options
         st.markdown("### 📥 Export Options")
-        if st.session_state.results_data:
+        if not results_df.empty:
             export_format = st.selectbox(
                 "Export Format",
                 ["CSV", "Excel", "JSON", "TXT"],
@@ -764,23 +2604,26 @@ def main():
                 "Include timestamp in filename", value=True)
 
             if st.button("📥 Generate Download Link"):
-                df = pd.DataFrame(st.session_state.results_data)
+                df = results_df
                 # Apply filters before export
                 filtered_df = apply_filters(df)
 
                 filename = os.path.splitext(st.session_state.filename)[
                     0] if st.session_state.filename else "gdt_results"
-                download_link = create_download_link(
-                    filtered_df, filename, export_format)
-                st.markdown(download_link, unsafe_allow_html=True)
-                st.success("Download link generated!")
+                analysis = st.session_state.analysis_results if include_analysis else None
+                data, file_name, mime = create_export(
+                    filtered_df, filename, export_format, analysis)
+                st.download_button(f"📥 Download {export_format}", data, file_name=file_name,
+                                   mime=mime, on_click='ignore', key='export_download')
+                st.success("Download ready!")
         else:
             st.info("Upload and process a file to enable export options")
 
     # Clear results with confirmation
     if st.sidebar.button("🗑️ Clear All Data"):
         if st.sidebar.button("⚠️ Confirm Clear"):
-            st.session_state.results_data = []
+            st.session_state.result_key = None
+            st.session_state.result_file_id = None
             st.session_state.filename = ""
             st.session_state.analysis_results = {}
             st.session_state.processing_history = []
@@ -799,36 +2642,9 @@ def main():
         </div>
         """, unsafe_allow_html=True)
 
-    # Apply filters function
-    def apply_filters(df):
-        filtered_df = df.copy()
-
-        if st.session_state.filter_settings['type_filter'] != 'All':
-            filtered_df = filtered_df[filtered_df['Type'] ==
-                                      st.session_state.filter_settings['type_filter']]
-
-        if st.session_state.filter_settings['location_filter'] != 'All':
-            filtered_df = filtered_df[filtered_df['Location'] ==
-                                      st.session_state.filter_settings['location_filter']]
-
-        if st.session_state.filter_settings['datum_filter'] != 'All':
-            filtered_df = filtered_df[filtered_df['Datum'] ==
-                                      st.session_state.filter_settings['datum_filter']]
-
-        # Apply range filter if exists
-        if 'range_filter' in st.session_state.filter_settings:
-            range_min, range_max = st.session_state.filter_settings['range_filter']
-            filtered_df = filtered_df[
-                (filtered_df['Numeric_Value'].isna()) |
-                ((filtered_df['Numeric_Value'] >= range_min) &
-                 (filtered_df['Numeric_Value'] <= range_max))
-            ]
-
-        return filtered_df
-
     # Display results with enhanced features
-    if st.session_state.results_data:
-        df = pd.DataFrame(st.session_state.results_data)
+    df = results_df
+    if not df.empty:
         filtered_df = apply_filters(df)
 
         # Enhanced metrics dashboard
@@ -854,29 +2670,38 @@ def main():
             st.metric("🔢 Unique Types", unique_types)
 
         # Tabbed interface for different views
-        tab1, tab2, tab3, tab4 = st.tabs(
-            ["📋 Data Table", "📊 Visualizations", "🔍 Analysis", "📈 Statistics"])
+        tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
+            ["📋 Data Table", "📊 Visualizations", "🔍 Analysis", "📈 Statistics", "🗄️ History",
+             "🔀 Compare"])
 
         with tab1:
             st.subheader("📋 Extracted GD&T Data")
 
-            # Enhanced table display
-            display_df = filtered_df.drop(
-                columns=['Numeric_Value'], errors='ignore')
-
-            # Color coding for different categories
-            def style_dataframe(df):
-                def color_category(val):
-                    if 'Datum' in str(val):
-                        return 'background-color: #e8f5e8'
-                    elif any(symbol in str(val) for symbol in ['─', '□', '○', '⌀']):
-                        return 'background-color: #fff3cd'
-                    return ''
-
-                return df.style.applymap(color_category, subset=['Type'])
+            # Server-side search, sort and pagination over the cached frame
+            col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+            with col1:
+                search = st.text_input("🔎 Search", key='table_search')
+            with col2:
+                sort_by = st.selectbox(
+                    "Sort by", ['(none)'] + TABLE_COLUMNS, key='table_sort_by')
+            with col3:
+                ascending = st.toggle("Ascending", value=True, key='table_ascending')
+            with col4:
+                page_size = st.selectbox(
+                    "Rows per page", TABLE_PAGE_SIZES, key='table_page_size')
+
+            table_df = search_and_sort(
+                filtered_df, search, None if sort_by == '(none)' else sort_by, ascending)
+            page_count = max(1, -(-len(table_df) // page_size))
+            if st.session_state.get('table_page', 1) > page_count:
+                st.session_state.table_page = page_count
+            page = st.number_input(
+                f"Page (of {page_count})", min_value=1, max_value=page_count,
+                key='table_page')
+            page_df = table_df.iloc[(page - 1) * page_size:page * page_size]
 
             st.dataframe(
-                style_dataframe(display_df),
+                style_table_page(page_df.drop(columns=['Numeric_Value'], errors='ignore')),
                 use_container_width=True,
                 hide_index=True,
                 column_config={
@@ -888,6 +2713,9 @@ def main():
                     "Category": st.column_config.TextColumn("Category", width="small")
                 }
             )
+            st.caption(
+                f"Rows {(page - 1) * page_size + 1 if len(table_df) else 0}–"
+                f"{(page - 1) * page_size + len(page_df)} of {len(table_df)}")
 
             # Filter summary
             if len(filtered_df) != len(df):
@@ -985,24 +2813,17 @@ def main():
                 st.bar_chart(location_counts)
 
                 # Numeric analysis
-                numeric_values = tolerance_df['Numeric_Value'].dropna()
-                if not numeric_values.empty:
+                value_stats = ToleranceStats.from_frame(tolerance_df)
+                if value_stats.count:
                     st.markdown("### 📏 Tolerance Value Statistics")
-                    stats_df = pd.DataFrame({
-                        'Statistic': ['Count', 'Mean', 'Std', 'Min', '25%', '50%', '75%', 'Max'],
-                        'Value': [
-                            len(numeric_values),
-                            numeric_values.mean(),
-                            numeric_values.std(),
-                            numeric_values.min(),
-                            numeric_values.quantile(0.25),
-                            numeric_values.quantile(0.5),
-                            numeric_values.quantile(0.75),
-                            numeric_values.max()
-                        ]
-                    })
                     st.dataframe(
-                        stats_df, use_container_width=True, hide_index=True)
+                        value_stats_frame(value_stats), use_container_width=True, hide_index=True)
+
+        with tab5:
+            render_store_query()
+
+        with tab6:
+            render_compare(df)
 
     else:
         # Enhanced instructions when no file is loaded
@@ -1025,6 +2846,9 @@ def main():
         sample_df = pd.DataFrame(sample_data)
         st.dataframe(sample_df, use_container_width=True, hide_index=True)
 
+        st.markdown("---")
+        render_store_query()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""Check the lexer extraction engine against the regex engine and benchmark both.
+
+Every file of the golden corpus (tools/corpus plus any paths given) and a
+set of synthetic files is extracted with each engine, from the whole text
+and from a line stream; any difference in the rows is reported and makes
+the script exit with status 1. Corpus files with a ``<file>.expected.json``
+fixture are also checked against the rows it holds, so a bug shared by both
+engines fails too; ``--record`` rewrites the fixtures from the reference
+engine. The synthetic files are then timed.
+
+Usage: python tools/compare_engines.py [FILE ...] [--sizes 1000,5000,20000]
+                                       [--repeat 3] [--json report.json] [--record]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_step import generate_step  # noqa: E402
+from main import EXTRACTION_ENGINES, ParseBudget, extract_tolerance_table  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+REFERENCE_ENGINE = "regex"
+EXPECTED_SUFFIX = ".expected.json"
+
+
+def unlimited_budget():
+    return ParseBudget(max_seconds=float("inf"), max_bytes=float("inf"))
+
+
+def first_difference(expected, actual):
+    for position, (want, got) in enumerate(zip(expected, actual)):
+        if want != got:
+            return f"row {position}: expected {want}, got {got}"
+    return f"expected {len(expected)} rows, got {len(actual)}"
+
+
+def expected_path(path):
+    return path + EXPECTED_SUFFIX
+
+
+def check_corpus(corpus, record=False):
+    """Compare every engine with the reference on each ``(name, text, fixture)``; returns the failures
+
+    ``fixture`` is the path of the expected-rows file, or None. With
+    ``record`` the reference rows are written to the fixtures
+    instead of being checked against them.
+    """
+    failures = []
+    for name, text, fixture in corpus:
+        expected = extract_tolerance_table(text, unlimited_budget(), REFERENCE_ENGINE)
+        if fixture and record:
+            with open(fixture, "w", encoding="utf-8") as f:
+                json.dump(expected, f, indent=1, ensure_ascii=False)
+                f.write("\n")
+        elif fixture and os.path.exists(fixture):
+            with open(fixture, encoding="utf-8") as f:
+                fixture_rows = json.load(f)
+            if expected != fixture_rows:
+                failures.append(f"{name} [expected rows]: {first_difference(fixture_rows, expected)}")
+        for engine in EXTRACTION_ENGINES:
+            for source, data in (("text", text), ("lines", text.splitlines(keepends=True))):
+                rows = extract_tolerance_table(data, unlimited_budget(), engine)
+                if rows != expected:
+                    failures.append(f"{name} [{engine}, {source}]: {first_difference(expected, rows)}")
+        print(f"  {name}: {len(expected)} rows", file=sys.stderr)
+    return failures
+
+
+def benchmark(text, repeat):
+    """Return the best wall time of each engine on ``text``"""
+    timings = {}
+    for engine in EXTRACTION_ENGINES:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            extract_tolerance_table(text, unlimited_budget(), engine)
+            best = min(best, time.perf_counter() - start)
+        timings[engine] = best
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", help="extra STEP files to add to the corpus")
+    parser.add_argument("--sizes", default="1000,5000,20000",
+                        help="comma-separated tolerance counts of the synthetic files")
+    parser.add_argument("--filler", type=int, default=20,
+                        help="unrelated geometry entities per tolerance")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per engine, best kept")
+    parser.add_argument("--json", help="also write the benchmark to this JSON file")
+    parser.add_argument("--record", action="store_true",
+                        help="write the reference engine's rows to the expected-rows fixtures")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "*.stp"))) + args.files:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            corpus.append((os.path.basename(path), f.read(), expected_path(path)))
+    synthetic = [(f"synthetic_{size}", generate_step(size, seed, args.filler))
+                 for seed, size in enumerate(sizes)]
+
+    print("Checking engines against the golden corpus...", file=sys.stderr)
+    failures = check_corpus(corpus + [(name, text, None) for name, text in synthetic], args.record)
+    for failure in failures:
+        print(f"MISMATCH {failure}")
+
+    results = []
+    header = f"{'file':>18} {'MB':>7}" + "".join(f" {engine + ' s':>9}" for engine in EXTRACTION_ENGINES) + f" {'speedup':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, text in synthetic:
+        megabytes = len(text.encode()) / 1024 / 1024
+        timings = benchmark(text, args.repeat)
+        speedup = timings[REFERENCE_ENGINE] / timings["lexer"]
+        results.append({"file": name, "mb": megabytes, "seconds": timings, "lexer_speedup": speedup})
+        print(f"{name:>18} {megabytes:>7.1f}" + "".join(f" {timings[engine]:>9.3f}" for engine in EXTRACTION_ENGINES)
+              + f" {speedup:>7.2f}x")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"mismatches": failures, "benchmark": results}, f, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
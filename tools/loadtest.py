@@ -0,0 +1,243 @@
+"""Concurrent-session load test for the Streamlit app.
+
+Drives main.py headlessly with streamlit.testing's AppTest. Each simulated
+session uploads a synthetic STEP file, applies a type filter and generates a
+CSV export; the sessions of one concurrency level run in parallel threads of
+this process, sharing the app's process-wide caches like a real server would.
+Every session uploads a different file and the caches are cleared between
+levels, so each upload is extracted; ``--shared`` gives all sessions the same
+file to measure the shared result cache instead.
+
+Usage: python tools/loadtest.py [--concurrency 1,2,4,8] [--tolerances 500]
+                                [--shared] [--json report.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import numpy as np
+import streamlit as st
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.testing.v1 import AppTest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_step import generate_step  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTERACTIONS = ("upload", "filter", "export")
+UPLOAD_KEY = "step_upload"
+
+# AppTest has no file upload support, so the driver swaps the main uploader
+# (matched on its key) for the synthetic file named in session state, then
+# runs main.py. Other uploaders, such as the Compare tab's, stay empty
+DRIVER_SCRIPT = '''
+import io, runpy
+import streamlit as st
+
+
+class SyntheticUpload(io.BytesIO):
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+        self.name = path.rsplit("/", 1)[-1]
+        self.type = "application/octet-stream"
+        self.file_id = st.session_state.upload_id
+        self.size = len(self.getvalue())
+
+
+file_uploader = st.file_uploader
+
+
+def synthetic_file_uploader(*args, key=None, **kwargs):
+    if key == {upload_key!r}:
+        return SyntheticUpload(st.session_state.upload_path)
+    return file_uploader(*args, key=key, **kwargs)
+
+
+st.file_uploader = synthetic_file_uploader
+runpy.run_path({main_path!r}, run_name="__main__")
+'''
+
+
+def share_runtime():
+    """Make every AppTest in this process use one mock Runtime.
+
+    AppTest installs and then clears a mock Runtime singleton around each run,
+    which breaks runs that overlap in time. A real server also has a single
+    runtime shared by all sessions, so pin one here.
+    """
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+
+
+class PeakMemorySampler:
+    """Sample this process's resident set size in a background thread"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def rss_bytes():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self.rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self.rss_bytes())
+
+
+def find_widget(widgets, label):
+    return next(w for w in widgets if w.label == label)
+
+
+def timed_run(app, timings, interaction, timeout):
+    start = time.perf_counter()
+    app.run(timeout=timeout)
+    timings[interaction].append(time.perf_counter() - start)
+    if app.exception:
+        raise RuntimeError(f"{interaction} failed: {app.exception[0].value}")
+
+
+def run_session(driver_path, upload_path, session_id, timeout):
+    """Simulate one user: upload, filter by type, export CSV"""
+    timings = {interaction: [] for interaction in INTERACTIONS}
+    app = AppTest.from_file(driver_path, default_timeout=timeout)
+    app.session_state["upload_path"] = upload_path
+    app.session_state["upload_id"] = f"session-{session_id}"
+    timed_run(app, timings, "upload", timeout)
+
+    type_filter = find_widget(app.selectbox, "Filter by Type")
+    type_filter.set_value(type_filter.options[-1])
+    timed_run(app, timings, "filter", timeout)
+
+    find_widget(app.selectbox, "Export Format").set_value("CSV")
+    find_widget(app.button, "📥 Generate Download Link").click()
+    timed_run(app, timings, "export", timeout)
+    return timings
+
+
+def run_level(driver_path, upload_paths, concurrency, timeout):
+    timings = {interaction: [] for interaction in INTERACTIONS}
+    errors = 0
+    with PeakMemorySampler() as memory, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        futures = [
+            pool.submit(run_session, driver_path, upload_paths[i % len(upload_paths)], i, timeout)
+            for i in range(concurrency)
+        ]
+        for future in futures:
+            try:
+                for interaction, values in future.result().items():
+                    timings[interaction].extend(values)
+            except Exception as e:
+                errors += 1
+                print(f"  session failed: {e}", file=sys.stderr)
+        elapsed = time.perf_counter() - start
+
+    completed = sum(len(values) for values in timings.values())
+    return {
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_per_s": completed / elapsed if elapsed else 0.0,
+        "peak_rss_mb": memory.peak_bytes / 1024 / 1024,
+        "latency_ms": {
+            interaction: {
+                f"p{p}": float(np.percentile(values, p) * 1000) for p in (50, 95, 99)
+            }
+            for interaction, values in timings.items() if values
+        },
+    }
+
+
+def print_report(results):
+    header = f"{'sessions':>8} {'interaction':>11} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for level in results:
+        for interaction, latency in level["latency_ms"].items():
+            print(f"{level['concurrency']:>8} {interaction:>11} "
+                  f"{latency['p50']:>9.1f} {latency['p95']:>9.1f} {latency['p99']:>9.1f}")
+        print(f"{'':>8} throughput {level['throughput_per_s']:.2f} interactions/s, "
+              f"peak RSS {level['peak_rss_mb']:.0f} MB, errors {level['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", default="1,2,4,8",
+                        help="comma-separated numbers of simultaneous sessions")
+    parser.add_argument("--tolerances", type=int, default=500,
+                        help="tolerances per synthetic STEP file")
+    parser.add_argument("--filler", type=int, default=5,
+                        help="unrelated geometry entities per tolerance")
+    parser.add_argument("--shared", action="store_true",
+                        help="give every session the same file, so uploads after the "
+                             "first are result cache hits")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", help="also write the report to this JSON file")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Keep the run's parts out of the real tolerance store
+        os.environ.setdefault("GDNT_STORE_PATH", os.path.join(workdir, "store.sqlite"))
+
+        upload_paths = []
+        for seed in range(1 if args.shared else max(levels)):
+            path = os.path.join(workdir, f"synthetic_{seed}.stp")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(generate_step(args.tolerances, seed, args.filler))
+            upload_paths.append(path)
+
+        driver_path = os.path.join(workdir, "driver.py")
+        with open(driver_path, "w", encoding="utf-8") as f:
+            f.write(DRIVER_SCRIPT.format(main_path=os.path.join(REPO_ROOT, "main.py"),
+                                         upload_key=UPLOAD_KEY))
+
+        # main.py loads its assets relative to the working directory
+        os.chdir(REPO_ROOT)
+        share_runtime()
+        results = []
+        for concurrency in levels:
+            print(f"Running {concurrency} concurrent session(s)...", file=sys.stderr)
+            # Each level starts cold, as uploads would hit the previous level's results
+            st.cache_resource.clear()
+            results.append(run_level(driver_path, upload_paths, concurrency, args.timeout))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""Memory profile of the upload-to-render path, with an allocation regression check.
+
+Drives main.py headlessly with streamlit.testing's AppTest on synthetic STEP
+files of increasing size, under tracemalloc. Every stage of the flow (pre-scan,
+line index, row dicts, statistics, DataFrames, Styler and table rendering,
+Plotly figures, revision compare and the exports) is wrapped so the
+peak memory it allocates above what was live when it started is recorded.
+Each session uploads the file, then exports it as CSV and as Excel.
+
+Stages are reported in bytes per MB of input and compared with a recorded
+baseline; the script exits with status 1 when any stage exceeds its baseline
+by more than the tolerance.
+
+Usage: python tools/memprofile.py [--sizes 500,2000,8000] [--record]
+                                  [--baseline tools/memory_baseline.json]
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from collections import defaultdict
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_step import generate_step  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory_baseline.json")
+EXPORT_FORMATS = ("CSV", "Excel")
+
+# Imports main once, so the stage wrappers installed on the module are seen by
+# every rerun, and swaps st.file_uploader for the synthetic file
+DRIVER_SCRIPT = '''
+import io
+import streamlit as st
+import main
+
+
+class SyntheticUpload(io.BytesIO):
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+        self.name = path.rsplit("/", 1)[-1]
+        self.type = "application/octet-stream"
+        self.file_id = path
+        self.size = len(self.getvalue())
+
+
+st.file_uploader = lambda *args, **kwargs: SyntheticUpload(st.session_state.upload_path)
+main.main()
+'''
+
+
+class StageProfiler:
+    """Record the peak traced memory of each stage above its starting point.
+
+    ``retained`` also records what a stage left allocated when it returned,
+    such as the row dicts of an extraction or the cached DataFrame of an
+    upload. Stages may nest: before a nested stage resets the tracemalloc peak, the
+    enclosing stage's peak so far is saved, so outer stages still see the
+    high-water mark of everything they called.
+    """
+
+    def __init__(self):
+        self.peaks = defaultdict(int)
+        self.retained = defaultdict(int)
+        self._stack = []  # [stage, bytes at entry, peak seen before nested resets]
+
+    def enter(self, stage):
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            self._stack[-1][2] = max(self._stack[-1][2], peak)
+        tracemalloc.reset_peak()
+        self._stack.append([stage, current, current])
+
+    def exit(self):
+        stage, start, earlier_peak = self._stack.pop()
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, earlier_peak)
+        self.peaks[stage] = max(self.peaks[stage], peak - start)
+        self.retained[stage] = max(self.retained[stage], current - start)
+        if self._stack:
+            self._stack[-1][2] = max(self._stack[-1][2], peak)
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.enter(stage)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.exit()
+        return wrapper
+
+    def reset(self):
+        self.peaks.clear()
+        self.retained.clear()
+
+
+def install_stages(profiler):
+    """Wrap the functions of each stage of the flow; returns the stage names in flow order"""
+    import main
+
+    stages = [
+        ("prescan", main, "prescan_step"),
+        ("line_index", main.RegexStepScan, "scan"),
+        ("line_index", main.LexerStepScan, "scan"),
+        ("rows", main, "extract_tolerance_table"),
+        ("statistics", main.ToleranceStats, "from_rows"),
+        ("statistics", main.ToleranceStats, "from_frame"),
+        ("upload", main, "get_or_extract"),
+        ("filtered_frame", main, "apply_filters"),
+        ("table_frame", main, "search_and_sort"),
+        ("styler", main, "style_table_page"),
+        ("table_render", st, "dataframe"),
+        ("figures", main, "create_visualizations"),
+        ("chart_render", st, "plotly_chart"),
+        ("compare", main, "compare_revisions"),
+        ("export", main, "create_export"),
+    ]
+    for stage, owner, attribute in stages:
+        setattr(owner, attribute, profiler.wrap(stage, getattr(owner, attribute)))
+    return list(dict.fromkeys(stage for stage, _, _ in stages)) + ["session"]
+
+
+def run_app(profiler, app, timeout):
+    profiler.enter("session")
+    try:
+        app.run(timeout=timeout)
+    finally:
+        profiler.exit()
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+
+
+def profile_session(profiler, driver_path, upload_path, timeout):
+    """Upload, render every tab and export in each format; returns the stage peaks and retained bytes"""
+    profiler.reset()
+    app = AppTest.from_file(driver_path, default_timeout=timeout)
+    app.session_state["upload_path"] = upload_path
+    run_app(profiler, app, timeout)
+
+    confirm = [button for button in app.button if button.label == "▶️ Run full extraction"]
+    if confirm:
+        confirm[0].click()
+        run_app(profiler, app, timeout)
+
+    for export_format in EXPORT_FORMATS:
+        next(box for box in app.selectbox
+             if box.label == "Export Format" and box.key != "compare_format").set_value(export_format)
+        next(button for button in app.button if button.label == "📥 Generate Download Link").click()
+        run_app(profiler, app, timeout)
+    return dict(profiler.peaks), dict(profiler.retained)
+
+
+def check_baseline(results, baseline, tolerance, slack_bytes):
+    """Return a message for every stage whose bytes per input MB exceed the baseline.
+
+    ``slack_bytes`` of absolute growth are always allowed, so stages that
+    allocate next to nothing do not fail on allocator noise.
+    """
+    regressions = []
+    for result in results:
+        recorded = baseline.get("sizes", {}).get(str(result["tolerances"]))
+        if recorded is None:
+            continue
+        for stage, per_mb in result["bytes_per_input_mb"].items():
+            limit = recorded.get(stage)
+            if limit is None:
+                continue
+            allowed = limit * (1 + tolerance) + slack_bytes / result["input_mb"]
+            if per_mb > allowed:
+                regressions.append(
+                    f"{result['tolerances']} tolerances, {stage}: {per_mb / 1024 / 1024:.2f} MB "
+                    f"per input MB, baseline {limit / 1024 / 1024:.2f}")
+    return regressions
+
+
+def print_report(results, stages):
+    header = f"{'stage':>15}" + "".join(f" {result['input_mb']:>9.1f}MB" for result in results)
+    print("Peak MB allocated per stage (MB per input MB in parentheses)")
+    print(header)
+    print("-" * len(header))
+    for stage in stages:
+        cells = []
+        for result in results:
+            peak = result["peak_bytes"].get(stage, 0)
+            per_mb = result["bytes_per_input_mb"].get(stage, 0)
+            cells.append(f" {peak / 1024 / 1024:>5.1f} ({per_mb / 1024 / 1024:>4.1f})")
+        print(f"{stage:>15}" + "".join(cells))
+
+    print()
+    print("MB still allocated when each stage returned")
+    print(header)
+    print("-" * len(header))
+    for stage in stages:
+        print(f"{stage:>15}" + "".join(
+            f" {result['retained_bytes'].get(stage, 0) / 1024 / 1024:>11.1f}" for result in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="500,2000,8000",
+                        help="comma-separated tolerance counts of the synthetic files")
+    parser.add_argument("--filler", type=int, default=20,
+                        help="unrelated geometry entities per tolerance")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--record", action="store_true",
+                        help="write the measurements as the new baseline instead of checking")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed growth over the baseline, as a fraction")
+    parser.add_argument("--slack-kb", type=float, default=512,
+                        help="absolute growth per stage that is always allowed")
+    parser.add_argument("--warmup", type=int, default=50,
+                        help="tolerances of an unrecorded first session that loads lazy imports")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", help="also write the measurements to this JSON file")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Keep the run's parts out of the real tolerance store
+        os.environ.setdefault("GDNT_STORE_PATH", os.path.join(workdir, "store.sqlite"))
+        driver_path = os.path.join(workdir, "driver.py")
+        with open(driver_path, "w", encoding="utf-8") as f:
+            f.write(DRIVER_SCRIPT)
+
+        # main.py loads its assets relative to the working directory
+        os.chdir(REPO_ROOT)
+        sys.path.insert(0, REPO_ROOT)
+        profiler = StageProfiler()
+        stages = install_stages(profiler)
+
+        tracemalloc.start()
+        results = []
+        # The first session also pays for one-off imports (Jinja templates for
+        # the Styler, Plotly's figure machinery), which would swamp small files
+        runs = [(args.warmup, "warmup")] if args.warmup else []
+        for tolerances, label in runs + [(size, "size") for size in sizes]:
+            upload_path = os.path.join(workdir, f"synthetic_{label}_{tolerances}.stp")
+            with open(upload_path, "w", encoding="utf-8") as f:
+                f.write(generate_step(tolerances, tolerances, args.filler))
+            input_mb = os.path.getsize(upload_path) / 1024 / 1024
+            print(f"Profiling {tolerances} tolerances ({input_mb:.1f} MB, {label})...", file=sys.stderr)
+
+            peaks, retained = profile_session(profiler, driver_path, upload_path, args.timeout)
+            if label == "warmup":
+                continue
+            results.append({
+                "tolerances": tolerances,
+                "input_mb": input_mb,
+                "peak_bytes": peaks,
+                "retained_bytes": retained,
+                "bytes_per_input_mb": {stage: peak / input_mb for stage, peak in peaks.items()},
+            })
+        tracemalloc.stop()
+
+    print_report(results, stages)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.record:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "filler": args.filler,
+                "sizes": {str(result["tolerances"]): {stage: round(per_mb) for stage, per_mb
+                                                      in result["bytes_per_input_mb"].items()}
+                          for result in results},
+            }, f, indent=2, sort_keys=True)
+        print(f"Recorded baseline in {args.baseline}", file=sys.stderr)
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --record first", file=sys.stderr)
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("filler") != args.filler:
+        sys.exit(f"Baseline was recorded with --filler {baseline.get('filler')}")
+    regressions = check_baseline(results, baseline, args.tolerance, args.slack_kb * 1024)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Generate synthetic STEP files with GD&T content for load and memory testing.
+
+Usage: python tools/synthetic_step.py OUTPUT.stp [--tolerances N] [--seed S] [--gzip]
+"""
+import argparse
+import gzip
+import random
+
+TOLERANCE_TYPES = [
+    "FLATNESS", "STRAIGHTNESS", "ROUNDNESS", "CYLINDRICITY", "PERPENDICULARITY",
+    "PARALLELISM", "ANGULARITY", "POSITION", "PROFILE_OF_SURFACE", "TOTAL_RUNOUT",
+]
+FEATURE_NAMES = ["Plane1 top", "Plane2 bottom", "Boss1 side", "hole", "slot", "cone face"]
+DATUM_LETTERS = "ABC"
+
+
+def generate_step(tolerances=100, seed=0, filler=0):
+    """Return the text of a STEP file with ``tolerances`` tolerance entities.
+
+    Half of the tolerances reference an AP242 datum system, the rest use the
+    legacy "(A)"-in-name convention. ``filler`` adds that many unrelated
+    geometry entities per tolerance to mimic the bulk of a real model.
+    """
+    rng = random.Random(seed)
+    lines = [
+        "ISO-10303-21;",
+        "HEADER;",
+        "FILE_DESCRIPTION(('synthetic GD&T part'),'2;1');",
+        "FILE_NAME('synthetic.stp','2024-01-01T00:00:00',(''),(''),'','','');",
+        "FILE_SCHEMA(('AP242_MANAGED_MODEL_BASED_3D_ENGINEERING_MIM_LF { 1 0 10303 442 1 1 4 }'));",
+        "ENDSEC;",
+        "DATA;",
+        "#1=PRODUCT_DEFINITION_SHAPE('','',#2);",
+        "#2=PRODUCT_DEFINITION('design','',#3,#4);",
+        "#20=(LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT(.MILLI.,.METRE.));",
+    ]
+
+    aspect_ids = []
+    next_id = 100
+    for name in FEATURE_NAMES:
+        lines.append(f"#{next_id}=SHAPE_ASPECT('{name}','',#1,.T.);")
+        aspect_ids.append(next_id)
+        next_id += 1
+
+    datum_ids = []
+    for letter, aspect_id in zip(DATUM_LETTERS, aspect_ids):
+        feature = FEATURE_NAMES[aspect_ids.index(aspect_id)].split()[0]
+        lines.append(f"#{next_id}=DATUM('{feature}',$,#1,.F.,'{letter}');")
+        datum_ids.append(next_id)
+        next_id += 1
+
+    compartment_ids = []
+    for datum_id in datum_ids:
+        lines.append(f"#{next_id}=DATUM_REFERENCE_COMPARTMENT('','',#1,.F.,#{datum_id},$);")
+        compartment_ids.append(next_id)
+        next_id += 1
+    datum_system_id = next_id
+    lines.append(
+        f"#{datum_system_id}=DATUM_SYSTEM('','',#1,.F.,({','.join(f'#{c}' for c in compartment_ids)}));")
+    next_id += 1
+
+    for _ in range(tolerances):
+        tol_type = rng.choice(TOLERANCE_TYPES)
+        aspect_id = rng.choice(aspect_ids)
+        value = round(rng.uniform(0.001, 0.2), 4)
+        tol_id, measure_id = next_id, next_id + 1
+        next_id += 2
+        if rng.random() < 0.5:
+            lines.append(
+                f"#{tol_id}={tol_type}_TOLERANCE('{tol_type.title()}','',#{measure_id},#{aspect_id},(#{datum_system_id}));")
+        else:
+            letter = rng.choice(DATUM_LETTERS)
+            lines.append(
+                f"#{tol_id}={tol_type}_TOLERANCE('{tol_type.title()} ({letter})','',#{measure_id},#{aspect_id});")
+        lines.append(f"#{measure_id}=LENGTH_MEASURE_WITH_UNIT(LENGTH_MEASURE({value}),#20);")
+
+        for _ in range(filler):
+            x, y, z = (round(rng.uniform(-100, 100), 6) for _ in range(3))
+            lines.append(f"#{next_id}=CARTESIAN_POINT('',({x},{y},{z}));")
+            next_id += 1
+
+    lines += ["ENDSEC;", "END-ISO-10303-21;"]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output")
+    parser.add_argument("--tolerances", type=int, default=100)
+    parser.add_argument("--filler", type=int, default=0,
+                        help="unrelated geometry entities per tolerance")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gzip", action="store_true", help="write gzip-compressed output")
+    args = parser.parse_args()
+
+    text = generate_step(args.tolerances, args.seed, args.filler)
+    opener = gzip.open if args.gzip else open
+    with opener(args.output, "wt", encoding="utf-8") as f:
+        f.write(text)
+
+
+if __name__ == "__main__":
+    main()